@@ -5,10 +5,18 @@ import scipy
 from scipy.io import wavfile
 import time
 import threading
-from queue import Queue
+import multiprocessing
+from queue import Queue, Empty, Full
 import os
 import re
 import math
+import json
+import argparse
+import subprocess
+import shutil
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
 from random import *
 import urllib.request
 import matplotlib.pyplot as plt
@@ -19,24 +27,432 @@ from tensorflow.contrib.rnn import MultiRNNCell, GRUCell, DropoutWrapper, LSTMCe
 
 def generate_mel_transform(start_mel_frequency, end_mel_frequency, mel_filters, frame_length):
     """Generates the matrix for the linear transformation that converts the frequency spectrum to a logarithmic scale"""
-    mel_points = np.linspace(start_mel_frequency, end_mel_frequency,
-                             mel_filters + 2)  # Equally spaced in Mel scale
-    hz_points = (700 * (10 ** (mel_points / 2595) - 1))  # Convert Mel to Hz
-    f_bin = np.floor((frame_length + 1) * hz_points / DataGenerator.sample_frequency)
+    return MelFilterBank(start_mel_frequency, end_mel_frequency, mel_filters, frame_length).dense()
 
-    f_bank = np.zeros((mel_filters, int(np.floor(frame_length / 2 + 1))))
-    for m in range(1, mel_filters + 1):
-        f_m_minus = int(f_bin[m - 1])  # left
-        f_m = int(f_bin[m])  # center
-        f_m_plus = int(f_bin[m + 1])  # right
 
-        for k in range(f_m_minus, f_m):
-            f_bank[m - 1, k] = (k - f_bin[m - 1]) / (f_bin[m] - f_bin[m - 1])
-        for k in range(f_m, f_m_plus):
-            f_bank[m - 1, k] = (f_bin[m + 1] - k) / (f_bin[m + 1] - f_bin[m])
-        f_bank[m - 1, f_m] = 1
+class MelFilterBank:
+    """
+    This is the linear transformation that converts the frequency spectrum to a logarithmic scale.
+
+    Each triangular filter is only non zero over a few neighbouring frequency bins, and none of them reach past the
+    first few hundred bins, so the frames are projected with a matrix multiplication against only the rows of those
+    bins. Gathering each filter's band and multiplying it on its own was tried too, but it is about 3 times slower than
+    the matrix multiplication. The bands are still stored, as the TensorFlow version uses them.
+    """
+
+    def __init__(self, start_mel_frequency, end_mel_frequency, mel_filters, frame_length):
+        mel_points = np.linspace(start_mel_frequency, end_mel_frequency,
+                                 mel_filters + 2)  # Equally spaced in Mel scale
+        hz_points = (700 * (10 ** (mel_points / 2595) - 1))  # Convert Mel to Hz
+        f_bin = np.floor((frame_length + 1) * hz_points / DataGenerator.sample_frequency)
+
+        left = f_bin[:-2, np.newaxis]
+        center = f_bin[1:-1, np.newaxis]
+        right = f_bin[2:, np.newaxis]
+
+        self.mel_filters = mel_filters
+        self.bins = int(np.floor(frame_length / 2 + 1))
+        self.width = int(np.max(np.maximum(right, center + 1) - left))
+        # the center is always part of the band, even when the right edge falls on the same bin
+
+        k = left + np.arange(self.width)
+        rising = (k - left) / np.maximum(center - left, 1)
+        falling = (right - k) / np.maximum(right - center, 1)
+        weights = np.where(k < center, rising, np.where(k < right, falling, 0))
+        weights[k == center] = 1
+        weights[k >= self.bins] = 0
+
+        self.indices = np.minimum(k, self.bins - 1).astype(np.int32)  # the frequency bin of every weight
+        self.weights = weights.astype(np.float32)
+        self.end = int(np.max(self.indices)) + 1  # the bins after this one don't affect any of the filters
+        self.matrix = self.dense()[:self.end].astype(np.float32)
+
+    def dense(self):
+        """Creates the full matrix of shape [bins, mel_filters] that this filter bank represents"""
+        f_bank = np.zeros((self.bins, self.mel_filters))
+        np.add.at(f_bank, (self.indices, np.arange(self.mel_filters)[:, np.newaxis]), self.weights)
+        return f_bank
+
+    def project(self, pow_frames, out=None):
+        """Projects power spectrum frames of shape [..., bins] (or [..., end]) onto the filters"""
+        return np.matmul(pow_frames[..., :self.end], self.matrix, out=out)
+
+    def project_tf(self, pow_frames):
+        """
+        The same as project but for TensorFlow tensors. This uses the bands, which only run on one frame at a time in
+        the exported model, so that the multiplications are left in float when the model is quantized.
+        """
+        bands = tf.gather(pow_frames, tf.constant(self.indices), axis=len(pow_frames.get_shape()) - 1)
+        return tf.reduce_sum(bands * tf.constant(self.weights), -1)
+
+
+class NoStage:
+    """What the StageProfiler measures stages with when it is switched off, a with statement that does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+class StageProfiler:
+    """
+    This class measures how long each stage of generating a batch takes, and how much memory it allocates
 
-    return f_bank.T
+    It is switched on with the NOTEWIZE_PROFILE environment variable(or --profile), which is either 1 to print a summary
+    table of the stages every few batches, or the path of a trace file that can be opened in a trace viewer such as
+    chrome://tracing. Every process writes its own trace, named after its process id. When the profiler is switched
+    off the stages cost next to nothing.
+
+    The memory of a stage is the most that was allocated during it at once. Before python 3.9 the peak of tracemalloc
+    can only be reset by clearing its traces, after which the blocks from before aren't traced when they are freed, so
+    there the memory of a stage doesn't take off what it frees from before it started.
+    """
+    environment_variable = "NOTEWIZE_PROFILE"
+    report_interval = 20  # in batches
+    max_events = 200000  # the oldest events are dropped after this so that the trace can't use up all the memory
+    no_stage = NoStage()  # contextlib.nullcontext would do the same, but it was only added in python 3.7
+
+    def __init__(self, setting=None):
+        setting = os.environ.get(StageProfiler.environment_variable, "") if setting is None else setting
+        self.enabled = setting not in ("", "0")
+        self.trace_path = setting if self.enabled and setting != "1" else None
+
+        self.origin = time.perf_counter()
+        self.events = []
+        self.totals = {}  # the calls, seconds and bytes of each stage
+        self.stack = []  # the stages that are currently running, innermost last
+        self.batches = 0
+        self.memory_offset = 0  # the memory that was traced before the traces were last cleared
+
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        """Forgets everything that has been measured so far"""
+        self.events = []
+        self.totals = {}
+        self.batches = 0
+
+    def stage(self, name, example=None):
+        """Measures everything inside the with statement as a stage with this name"""
+        if not self.enabled:
+            return StageProfiler.no_stage
+        return self.measure(name, example)
+
+    @contextmanager
+    def measure(self, name, example):
+        current, peak = self.traced_memory()
+        if len(self.stack) != 0:
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+        frame = {"memory": current, "peak": current}
+        self.stack.append(frame)
+        self.reset_peak()
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            end_time = time.perf_counter()
+            current, peak = self.traced_memory()
+            frame["peak"] = max(frame["peak"], peak)
+            self.stack.pop()
+            if len(self.stack) != 0:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], frame["peak"])
+            self.reset_peak()
+
+            allocated = frame["peak"] - frame["memory"]  # the most memory that the stage used at once
+            totals = self.totals.setdefault(name, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += end_time - start_time
+            totals[2] += allocated
+
+            if self.trace_path is not None:
+                self.events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": 0,
+                                    "ts": (start_time - self.origin) * 1e6, "dur": (end_time - start_time) * 1e6,
+                                    "args": {"batch": self.batches, "example": example, "bytes": allocated}})
+                if len(self.events) > StageProfiler.max_events:
+                    del self.events[:len(self.events) - StageProfiler.max_events]
+
+            if name == "batch":
+                self.batches += 1
+                if self.batches % StageProfiler.report_interval == 0:
+                    self.report()
+
+    def traced_memory(self):
+        """The current and peak traced memory, counted from when the profiler started"""
+        current, peak = tracemalloc.get_traced_memory()
+        return self.memory_offset + current, self.memory_offset + peak
+
+    def reset_peak(self):
+        """Sets the peak of the traced memory to the current memory"""
+        if hasattr(tracemalloc, "reset_peak"):  # this was only added in python 3.9
+            tracemalloc.reset_peak()
+        else:
+            # clearing the traces also clears the peak, and the memory that was traced is carried on in the offset
+            self.memory_offset += tracemalloc.get_traced_memory()[0]
+            tracemalloc.clear_traces()
+
+    def report(self):
+        """Prints the summary table and writes the trace file"""
+        if not self.enabled or self.batches == 0:
+            return
+
+        batch_time = self.totals["batch"][1] if "batch" in self.totals else 0
+        lines = ["Generator stages of process " + str(os.getpid()) + " over " + str(self.batches) + " batches",
+                 "{0:<10} {1:>8} {2:>12} {3:>14} {4:>8} {5:>12}".format(
+                     "Stage", "Calls", "ms/call", "ms/batch", "%", "MB/call")]
+        for name, (calls, seconds, allocated) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append("{0:<10} {1:>8d} {2:>12.3f} {3:>14.3f} {4:>8.1f} {5:>12.3f}".format(
+                name, calls, 1000 * seconds / calls, 1000 * seconds / self.batches,
+                100 * seconds / batch_time if batch_time != 0 else 0, allocated / calls / 2 ** 20))
+        print("\n".join(lines))
+
+        if self.trace_path is not None:
+            root, extension = os.path.splitext(self.trace_path)
+            with open(root + "-" + str(os.getpid()) + (extension if len(extension) != 0 else ".json"), "w") as file:
+                json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+
+
+class FeatureExtractor:
+    """
+    This class converts the signals of a whole batch into the log mel spectrum frames that are input into the model.
+
+    The things that don't depend on the signal(the window and the filter bank) are only computed once and then reused
+    for every batch. The batch is padded and pre-emphasised as a whole, and then the spectrum is found one example at a
+    time in scratch arrays that are reused by every batch, so that the temporary arrays are only ever the size of one
+    example instead of growing with the batch.
+    """
+
+    def __init__(self, num_frames, profiler=None):
+        self.num_frames = num_frames
+        self.profiler = StageProfiler("0") if profiler is None else profiler
+        self.padded_length = (num_frames - 1) * Model.frame_step + Model.frame_length
+
+        self.window = np.hamming(Model.frame_length).astype(np.float32)
+        self.mel_bank = Model.mel_bank
+
+        self.pad_signals = None  # made for the first batch, and then only again if the shape of the batch changes
+        self.frames = np.empty((num_frames, Model.frame_length), np.float32)
+        self.pow_frames = np.empty((num_frames, self.mel_bank.end), np.float32)
+        self.imaginary_power = np.empty((num_frames, self.mel_bank.end), np.float32)
+
+    def frame(self, signals):
+        """Splits signals of shape [batch, samples] into overlapping frames, which are views so nothing is copied"""
+        batch_stride, sample_stride = signals.strides
+        return np.lib.stride_tricks.as_strided(signals,
+                                               (signals.shape[0], self.num_frames, Model.frame_length),
+                                               (batch_stride, Model.frame_step * sample_stride, sample_stride),
+                                               writeable=False)
+
+    def __call__(self, signals, out=None, previous_samples=None):
+        """
+        Converts signals of shape [batch, samples] to log mel frames of shape [batch, frames, mel_filters], which are
+        written into out when it is given. When the signals carry on from earlier ones, the sample before each of them
+        can be given, so that the first sample is pre-emphasised the same as it would be in the whole signal.
+        """
+        batch_size, length = signals.shape
+        if out is None:
+            out = np.empty((batch_size, self.num_frames, Model.mel_filters), np.float32)
+
+        with self.profiler.stage("framing"):
+            padded_shape = (batch_size, max(length, self.padded_length))
+            if self.pad_signals is None or self.pad_signals.shape != padded_shape:
+                self.pad_signals = np.zeros(padded_shape, np.float32)
+            pad_signals = self.pad_signals
+            pad_signals[:, length:] = 0
+            pad_signals[:, 0] = signals[:, 0]
+            if previous_samples is not None:
+                pad_signals[:, 0] -= Model.pre_emphasis * previous_samples
+            np.multiply(signals[:, :-1], -Model.pre_emphasis, out=pad_signals[:, 1:length])
+            pad_signals[:, 1:length] += signals[:, 1:]
+            # this is a simple noise filter
+
+            frames = self.frame(pad_signals)
+
+        for example in range(batch_size):
+            with self.profiler.stage("fft", example):
+                np.multiply(frames[example], self.window, out=self.frames)
+                # this applies the hamming window
+
+                spectrum = np.fft.rfft(self.frames, Model.frame_length)[..., :self.mel_bank.end]
+                # the power of the frequencies above the last filter is never used
+                np.square(spectrum.real, out=self.pow_frames, casting="same_kind")
+                np.square(spectrum.imag, out=self.imaginary_power, casting="same_kind")
+                self.pow_frames += self.imaginary_power
+                self.pow_frames /= Model.frame_length  # Power Spectrum
+                del spectrum
+
+            with self.profiler.stage("mel", example):
+                self.mel_bank.project(self.pow_frames, out[example])
+
+        filter_banks = out
+        filter_banks[filter_banks == 0] = np.finfo(float).eps
+        # doesn't allow for 0 to increase stability. i.e. no dividing by zero
+        np.log(filter_banks, out=filter_banks)
+        # puts the magnitudes onto a logarithmic scale
+
+        return filter_banks
+
+
+class GeneratorWorkspace:
+    """
+    This class owns the arrays that a DataGenerator generates its batches into, so that they aren't allocated again
+    for every batch
+
+    The signals are only needed while a batch is being generated, so they are reused by every batch. The features and
+    labels are handed out with the batch, so they are rotated between a few sets of arrays, and a batch stays valid
+    until slots - 1 more batches have been generated.
+    """
+    slots = 8
+
+    def __init__(self, example_length, num_frames, feature_dtype, slots=None):
+        self.slots = GeneratorWorkspace.slots if slots is None else slots
+        self.signals = np.zeros((Trainer.batch_size, example_length), np.float32)
+        self.data_in = [np.empty((Trainer.batch_size, num_frames, Model.mel_filters), np.float32)
+                        for _ in range(self.slots)]
+        self.data_out = [np.empty((Trainer.batch_size, num_frames, Model.end_pitch - Model.start_pitch), np.uint8)
+                         for _ in range(self.slots)]
+        self.features = self.data_in
+        if feature_dtype != np.float32:
+            self.features = [np.empty(data_in.shape, feature_dtype) for data_in in self.data_in]
+            # the float32 features are converted into these
+
+        self.slot = -1
+
+    def next(self):
+        """The arrays for the next batch, which are the signals and labels cleared, and the features and their copy"""
+        self.slot = (self.slot + 1) % self.slots
+        self.signals[:] = 0
+        self.data_out[self.slot][:] = 0
+        return self.signals, self.data_in[self.slot], self.data_out[self.slot], self.features[self.slot]
+
+
+class FeatureStatistics:
+    """
+    This class keeps the mean and variance of each mel bin over all of the frames that it is given
+
+    The statistics are updated a whole batch at a time and two of them can be merged(Chan et al.'s parallel form of
+    Welford's algorithm), so they can be collected in a single pass by any amount of workers and then combined. The
+    model normalises its inputs with them, so they are saved next to the checkpoint that was trained with them.
+    """
+    warmup_batches = 50  # the batches that the statistics are collected from when the data source has none
+    min_variance = 1e-6  # so that a mel bin that never changes isn't divided by 0
+
+    def __init__(self, mel_filters=None, count=0, mean=None, m2=None):
+        mel_filters = Model.mel_filters if mel_filters is None else mel_filters
+        self.count = count
+        self.mean = np.zeros(mel_filters) if mean is None else np.asarray(mean, np.float64)
+        self.m2 = np.zeros(mel_filters) if m2 is None else np.asarray(m2, np.float64)
+        # m2 is the sum of the squared differences from the mean
+
+    @property
+    def variance(self):
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(np.maximum(self.variance, FeatureStatistics.min_variance))
+
+    def update(self, data_in):
+        """Adds the frames of a batch of shape [..., mel_filters] or [..., mel_filters, 1]"""
+        values = np.reshape(data_in, [-1, len(self.mean)]).astype(np.float64)
+        mean = np.mean(values, 0)
+        self.merge(FeatureStatistics(len(self.mean), len(values), mean, np.sum(np.square(values - mean), 0)))
+
+    def merge(self, other):
+        """Adds the frames that another collector has seen, as if they had been given to this one"""
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.count * other.count / count
+        self.count = count
+
+    def matches(self, other):
+        """Whether another collector has the same statistics as this one"""
+        return self.count == other.count and np.allclose(self.mean, other.mean) and np.allclose(self.m2, other.m2)
+
+    def to_json(self):
+        return {"count": self.count, "mean": self.mean.tolist(), "m2": self.m2.tolist()}
+
+    @staticmethod
+    def from_json(entry):
+        return FeatureStatistics(len(entry["mean"]), entry["count"], entry["mean"], entry["m2"])
+
+    def save(self, file_path):
+        directory = os.path.dirname(file_path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        np.savez(file_path, count=self.count, mean=self.mean, m2=self.m2)
+
+    @staticmethod
+    def load(file_path):
+        with np.load(file_path) as file:
+            return FeatureStatistics(len(file["mean"]), int(file["count"]), file["mean"], file["m2"])
+
+    @staticmethod
+    def constant():
+        """The statistics that were used before they were collected, which older saves were trained with"""
+        return FeatureStatistics(count=1, mean=np.full(Model.mel_filters, DataGenerator.data_mean),
+                                 m2=np.full(Model.mel_filters, DataGenerator.data_var ** 2))
+
+    @staticmethod
+    def collect(data_source, batches=None):
+        """Collects the statistics of the next few batches of a data source"""
+        batches = FeatureStatistics.warmup_batches if batches is None else batches
+        statistics = FeatureStatistics()
+
+        print("Collecting the feature statistics from " + str(batches) + " batches")
+        for _ in range(batches):
+            data_in, _ = data_source.get_batch()
+            statistics.update(data_in)
+        return statistics
+
+
+class AliasSampler:
+    """
+    This class draws indices at random in proportion to their weights, in constant time for each draw
+
+    It uses Vose's alias method, where every index has a column that is split between itself and one alias. A draw
+    picks a column uniformly and then the index or its alias by a second uniform, so the amount of weights doesn't
+    matter and any amount of draws can be made at once.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, np.float64)
+        if weights.ndim != 1 or len(weights) == 0 or np.any(weights < 0) or not np.sum(weights) > 0:
+            raise ValueError("The weights must be a non empty list of non negative numbers with a positive sum")
+
+        self.size = len(weights)
+        self.probabilities = np.ones(self.size)
+        self.aliases = np.arange(self.size)
+
+        scaled = weights * self.size / np.sum(weights)
+        small = [index for index in range(self.size) if scaled[index] < 1]
+        large = [index for index in range(self.size) if scaled[index] >= 1]
+        while small and large:
+            index = small.pop()
+            alias = large.pop()
+            self.probabilities[index] = scaled[index]
+            self.aliases[index] = alias
+            scaled[alias] -= 1 - scaled[index]
+            (small if scaled[alias] < 1 else large).append(alias)
+        # anything left over is only off from 1 by rounding errors, so it keeps the whole of its column
+
+    def sample(self, column_draws, alias_draws):
+        """Turns two arrays of uniforms in [0, 1) into the drawn indices"""
+        columns = np.minimum((column_draws * self.size).astype(np.int64), self.size - 1)
+        return np.where(alias_draws < self.probabilities[columns], columns, self.aliases[columns])
+
+    def draw(self, size=None):
+        """Draws an array of indices, or just one index when there isn't a size"""
+        if size is None:
+            return int(self.draw(1)[0])
+        column_draws, alias_draws = np.random.random((2, size))
+        return self.sample(column_draws, alias_draws)
 
 
 class DataGenerator:
@@ -48,9 +464,15 @@ class DataGenerator:
 
     sample_frequency = 44100
 
+    feature_dtype = np.float32  # the features can be made float16, which halves the size of the batches
+    # the labels are uint8, 1 when a note is on, and are only expanded into the one hot pairs inside of the graph
+
     guitars_folder = "sounds/guitars"
     noise_folder = "sounds/noise"
     instruments_folder = "sounds/instruments"
+    chords_file = "sounds/chords.json"
+    sound_bank_folder = "sounds/bank"
+    chords_url = "http://www.chordie.com/chords.php"
 
     data_start_pitch = 24
     data_end_pitch = 84
@@ -75,16 +497,21 @@ class DataGenerator:
 
     note_duration_max = 2.4  # in seconds
     note_duration_min = .1  # in seconds
-    resonance_volume_mean = 0.05
-    resonance_volume_sd = 0.02
-    resonance_amount = 4
 
     chord_delay_sd = .0002
     chord_delay_factor = .002
 
     roll = 3  # the max 'out of tune'ness
 
-    def __init__(self):
+    actions = ["note", "chord", "repeat", "guitar_swap", "pause"]
+    action_weights = [8, 6, 1, 1, 4]  # repeats can only be chosen when there is a chord to repeat
+    action_block = 64  # the amount of actions that the random numbers are drawn for at once
+
+    event_dtype = np.dtype([("start", np.int64), ("duration", np.int64), ("pitch", np.int64), ("roll", np.int64),
+                            ("volume", np.float64), ("guitar", np.int64)])
+    max_events = 1024  # the space that is first made for the notes of an example, more is made when it runs out
+
+    def __init__(self, profiler=None):
 
         self.guitars = self.load_sound_from(DataGenerator.guitars_folder)
         self.noise = self.load_sound_from(DataGenerator.noise_folder)
@@ -93,252 +520,372 @@ class DataGenerator:
         # better
 
         self.chords = DataGenerator.load_chords()
-
-        self.queue = Queue()
-        self.thread = GeneratorThread(self)
-        self.thread.start()
+        self.guitar_chords = []
+        self.chord_samplers = []
+        for guitar in self.guitars:
+            # each guitar has its own table of the chords that it can play, with the notes that are in its range
+            chords = [(chord, np.array([note for note in chord.notes if note in guitar.range], np.int64))
+                      for chord in self.chords]
+            chords = [(chord, notes) for chord, notes in chords if len(notes) > 0 and chord.weight > 0]
+            if len(chords) == 0:
+                chords = [(None, np.zeros(0, np.int64))]  # then chords don't play anything on this guitar
+            self.guitar_chords.append([notes for _, notes in chords])
+            self.chord_samplers.append(AliasSampler([1 if chord is None else chord.weight for chord, _ in chords]))
+
+        self.guitar_sampler = AliasSampler(np.ones(len(self.guitars)))
+        without_repeat = [0 if action == "repeat" else weight
+                          for action, weight in zip(DataGenerator.actions, DataGenerator.action_weights)]
+        self.action_samplers = (AliasSampler(without_repeat), AliasSampler(DataGenerator.action_weights))
+        # indexed by whether there is a chord that can be repeated
+        self.events = np.zeros(DataGenerator.max_events, DataGenerator.event_dtype)
+        self.chord_delays = np.arange(max(map(len, (chord.notes for chord in self.chords)), default=0)) * \
+            DataGenerator.chord_delay_factor
+
+        self.feature_dtype = DataGenerator.feature_dtype
+        self.profiler = StageProfiler() if profiler is None else profiler
+        self.feature_extractors = {}  # for each of the amounts of frames that have been used
+        self.workspaces = {}  # for each of the example lengths, since their signals are different lengths
+        self.set_example_length(Trainer.example_length)
+
+    def set_example_length(self, example_length):
+        """Makes the examples of the next batches this many samples long"""
+        self.example_length = example_length
+        self.num_frames = Model.frames_for(example_length)
+        if self.num_frames not in self.feature_extractors:
+            self.feature_extractors[self.num_frames] = FeatureExtractor(self.num_frames, self.profiler)
+        if example_length not in self.workspaces:
+            # the signals of the workspace are as long as the examples, so lengths with the same frames can't share one
+            self.workspaces[example_length] = GeneratorWorkspace(example_length, self.num_frames, self.feature_dtype)
+        self.feature_extractor = self.feature_extractors[self.num_frames]
+        self.workspace = self.workspaces[example_length]
 
     @property
     def generate_batch(self):
-        """Generates a new batch"""
+        """
+        Generates a new batch. The batch is made in the arrays of the workspace, so it is only valid until
+        GeneratorWorkspace.slots - 1 more batches have been generated.
+        """
 
-        num_frames = int(np.ceil(float(np.abs(Trainer.example_length - Model.frame_length)) / Model.frame_step))
+        with self.profiler.stage("batch"):
+            num_frames = self.num_frames
 
-        data_in = np.zeros((Trainer.batch_size, num_frames, Model.mel_filters), np.float32)
-        data_out = np.zeros((Trainer.batch_size, num_frames, Model.end_pitch - Model.start_pitch, 2), np.float32)
-        data_out[:, :, :] = [1, 0]
-        # Init the tensors
+            signals, data_in, data_out, features = self.workspace.next()
+            # Init the tensors
 
-        for example in range(0, Trainer.batch_size):
+            for example in range(0, Trainer.batch_size):
 
-            volume = 10 ** uniform(DataGenerator.min_overall_volume, DataGenerator.max_overall_volume)
+                with self.profiler.stage("schedule", example):
+                    events, noises, volume = self.schedule_example()
 
-            guitar = choice(self.guitars)
-            notes = []
-            noises = []
+                signal = signals[example]
+                # next, all those features are added to the signal
 
-            # add noise
-            for noise_type in sample(self.noise, DataGenerator.layers_of_noise):
-                current_volume = DataGenerator.noise_volume * (10 ** gauss(0, DataGenerator.noise_volume_sd)) / np.sqrt(
-                    DataGenerator.layers_of_noise)
-                start_offset = randrange(0, noise_type.length)
+                with self.profiler.stage("noise", example):
+                    for noise in noises:
+                        DataGenerator.mix_noise(signal, noise.noise_data, noise.start_offset, noise.volume)
 
-                noises.append(Noise(start_offset, noise_type, current_volume))
+                with self.profiler.stage("notes", example):
+                    self.render_events(signal, data_out[example], events)
 
-            current_time = DataGenerator.sample_frequency * DataGenerator.initial_pause
-            last = []
+                signal *= volume  # apply the volume
 
-            # adds features forwards through time until the end is reached
-            # hopefully these features are comparable to real music
-            while current_time < Trainer.example_length - Model.frame_step:
+                if example < 10 and False:  # this is just for debugging
+                    print(example)
+                    scipy.io.wavfile.write("trash/test" + str(example)
+                                           + ".wav", 44100, signal)
+                    with open("trash/test" + str(example) + "log.txt", "w") as file:
+                        file.write("DATA\n")
+                        file.write("NOTES\n")
+                        for note in events:
+                            file.write(str(note) + "\n")
+                        file.write("NOISE\n")
+                        for note in noises:
+                            file.write(str(note) + "\n")
 
-                action = DataGenerator.weighted_choice(
-                    {"note": 8, "chord": 6, "repeat": 0 if len(last) == 0 else 1, "guitar_swap": 1, "pause": 4})
+            self.feature_extractor(signals, data_in)
+            # the features of the whole batch are extracted at once
 
-                if action == "note":  # add a note
+            for example in range(0, Trainer.batch_size):
+                if example < 10 and False:  # this is just for debugging
+                    plt.imshow(np.transpose(data_in[example]), cmap='nipy_spectral', interpolation='nearest')
+                    plt.colorbar()
+                    plt.show()
 
-                    for note in last:
-                        note.duration = int(
-                            max(min(current_time - note.start_time - uniform(0, 500), note.duration), 0))
+                    plt.imshow(np.transpose(data_out[example]), cmap='nipy_spectral', interpolation='nearest')
+                    plt.colorbar()
+                    plt.show()
 
-                    last = []
+            if features is not data_in:
+                np.copyto(features, data_in)
+            return np.reshape(features, [Trainer.batch_size, num_frames, Model.mel_filters, 1]), data_out
 
-                    duration = DataGenerator.sample_frequency * (.5 * random() * (
-                            DataGenerator.note_duration_max - DataGenerator.note_duration_min) + DataGenerator.note_duration_min)
-                    pitch = randrange(guitar.range.start, guitar.range.stop)
-                    current_volume = 10 ** gauss(0, DataGenerator.note_volume_sd)
-                    roll = randrange(-DataGenerator.roll, DataGenerator.roll)
+    def schedule_example(self):
+        """
+        Decides what is played in an example, which is the notes, the layers of noise and the overall volume.
+        The features are added forwards through time until the end of the example is reached. The notes are written
+        into self.events, a record array that is reused by every example, so the notes that are returned are only
+        valid until the next example is scheduled.
+        """
+        volume = 10 ** uniform(DataGenerator.min_overall_volume, DataGenerator.max_overall_volume)
 
-                    current = Note(current_time, min(duration, Trainer.example_length - current_time), pitch, roll,
-                                   guitar, current_volume,
-                                   DataGenerator.lstm_delay * Model.samples_per_dft, "note")
-                    notes.append(current)
-                    for res in self.make_resonances(current):
-                        notes.append(res)
+        guitar = self.guitar_sampler.draw()
+        noises = []
 
-                    current_time += duration * uniform(.4, .6)
+        # add noise
+        for noise_type in sample(self.noise, DataGenerator.layers_of_noise):
+            current_volume = DataGenerator.noise_volume * (10 ** gauss(0, DataGenerator.noise_volume_sd)) / np.sqrt(
+                DataGenerator.layers_of_noise)
+            start_offset = randrange(0, noise_type.length)
 
-                elif action == "chord":  # add a chord
+            noises.append(Noise(start_offset, noise_type, current_volume))
 
-                    for note in last:
-                        note.duration = int(
-                            max(min(current_time - note.start_time - uniform(0, 500), note.duration), 0))
+        events = self.events
+        jitters, rolls, delays = self.draw_notes(len(events))
+        count = 0
+        last = slice(0, 0)  # the notes of the last chord, which are what a repeat plays again
 
-                    last = []
+        current_time = DataGenerator.sample_frequency * DataGenerator.initial_pause
+        actions = self.draw_actions()
+        row = 0
 
-                    chord_type = DataGenerator.weighted_choice(dict(map(lambda x: (x, x.weight), self.chords)))
-                    chord_notes = list(filter(lambda x: x in guitar.range, chord_type.notes))
-                    current_volume = 10 ** gauss(0, DataGenerator.note_volume_sd)
+        # adds features forwards through time until the end is reached
+        # hopefully these features are comparable to real music
+        while current_time < self.example_length - Model.frame_step:
 
-                    duration = DataGenerator.sample_frequency * (.25 + .25 * random() * (
-                            DataGenerator.note_duration_max - DataGenerator.note_duration_min) + DataGenerator.note_duration_min)
+            if row == len(actions):
+                actions = self.draw_actions()
+                row = 0
+            action, repeat_action, chord_indices, guitar_draw, length_draw, pick_draw, advance_draw, volume_draw = \
+                actions[row]
+            row += 1
 
-                    for index, note in enumerate(chord_notes):
-                        roll = randrange(-DataGenerator.roll, DataGenerator.roll)
-                        start_sample = current_time + gauss(index * DataGenerator.chord_delay_factor,
-                                                            DataGenerator.chord_delay_sd) * DataGenerator.sample_frequency
-                        current = Note(start_sample,
-                                       min(duration, Trainer.example_length - start_sample), note, roll,
-                                       guitar, current_volume,
-                                       DataGenerator.lstm_delay * Model.samples_per_dft,
-                                       "chord(" + chord_type.name + ")")
-                        last.append(current)
-                        for res in self.make_resonances(current):
-                            notes.append(res)
-                        notes.append(current)
+            if last.stop > last.start:
+                action = repeat_action
 
-                    current_time += duration * uniform(.4, .9)
+                if action != "guitar_swap" and action != "pause":
+                    # the last chord is cut off a little before whatever is played next
+                    durations = events["duration"][last]
+                    np.minimum(current_time - events["start"][last] - jitters[last], durations, durations,
+                               casting="unsafe")
+                    np.maximum(durations, 0, durations)
 
-                elif action == "repeat":  # repeat the last thing that was played
+            if action == "note":  # add a note
 
-                    for note in last:
-                        note.duration = int(
-                            max(min(current_time - note.start_time - uniform(0, 500), note.duration), 0))
+                if count == len(events):
+                    events = self.grow_events()
+                    jitters, rolls, delays = self.draw_notes(len(events))
+                last = slice(count, count)
 
-                    new_last = []
-                    for note in last:
-                        current = Note(current_time, note.duration, note.pitch,
-                                       note.roll, note.guitar, note.volume,
-                                       note.output_delay, "re" + note.origin, note.outs)
+                duration = DataGenerator.sample_frequency * (.5 * length_draw * (
+                        DataGenerator.note_duration_max - DataGenerator.note_duration_min) + DataGenerator.note_duration_min)
+                guitar_range = self.guitars[guitar].range
 
-                        notes.append(current)
-                        new_last.append(current)
-                        for res in self.make_resonances(current):
-                            notes.append(res)
+                events[count] = (current_time, min(duration, self.example_length - current_time),
+                                 guitar_range.start + int(pick_draw * len(guitar_range)), rolls[count],
+                                 10 ** (volume_draw * DataGenerator.note_volume_sd), guitar)
+                count += 1
 
-                    current_time += last[0].duration * uniform(.4, .9)
-                    last = new_last
+                current_time += duration * (.4 + .2 * advance_draw)
 
-                elif action == "guitar_swap":  # switch guitar
-                    guitar = choice(self.guitars)
+            elif action == "chord":  # add a chord
 
-                elif action == "pause":  # add a pause
-                    current_time += DataGenerator.sample_frequency * DataGenerator.pause_duration * uniform(1, 1.5)
+                chord_notes = self.guitar_chords[guitar][chord_indices[guitar]]
+                size = len(chord_notes)
+                if count + size > len(events):
+                    events = self.grow_events()
+                    jitters, rolls, delays = self.draw_notes(len(events))
+                last = slice(count, count + size)
 
-            # finished adding features
+                duration = DataGenerator.sample_frequency * (.25 + .25 * length_draw * (
+                        DataGenerator.note_duration_max - DataGenerator.note_duration_min) + DataGenerator.note_duration_min)
+                starts = current_time + (self.chord_delays[:size] + delays[last]) * DataGenerator.sample_frequency
 
-            signal = np.zeros([Trainer.example_length])
-            # next, all those features are added to the signal
+                chord = events[last]
+                chord["start"] = starts
+                chord["duration"] = np.minimum(duration, self.example_length - starts)
+                chord["pitch"] = chord_notes
+                chord["roll"] = rolls[last]
+                chord["volume"] = 10 ** (volume_draw * DataGenerator.note_volume_sd)
+                chord["guitar"] = guitar
+                count += size
 
-            for noise in noises:
-                signal += noise.volume * np.roll(
-                    np.tile(noise.noise_data.data, int(math.ceil(len(signal) / noise.noise_data.length))),
-                    noise.start_offset)[0:signal.size]
+                current_time += duration * (.4 + .5 * advance_draw)
 
-            for note in notes:
-                if not note.outs:
-                    continue
+            elif action == "repeat":  # repeat the last thing that was played
 
-                data_start_sample = int(
-                    (note.pitch - Model.start_pitch) * DataGenerator.note_duration_max * DataGenerator.sample_frequency)
+                size = last.stop - last.start
+                if count + size > len(events):
+                    events = self.grow_events()
+                    jitters, rolls, delays = self.draw_notes(len(events))
 
-                start_frame = int(
-                    (note.start_time + note.output_delay) * Model.dft_rate / DataGenerator.sample_frequency)
-                end_frame = min(int((note.start_time + note.duration + note.output_delay) * Model.dft_rate /
-                                    DataGenerator.sample_frequency), num_frames)
+                events[count:count + size] = events[last]
+                events["start"][count:count + size] = current_time
 
-                if end_frame >= num_frames:
-                    continue
+                current_time += events["duration"][last.start] * (.4 + .5 * advance_draw)
+                last = slice(count, count + size)
+                count += size
 
-                signal[note.start_time:note.start_time + note.duration] += \
-                    note.volume * np.roll(
-                        note.guitar.data[data_start_sample:data_start_sample + note.duration],
-                        note.roll)
+            elif action == "guitar_swap":  # switch guitar
+                guitar = guitar_draw
 
-                data_out[example, start_frame + 1:end_frame, note.pitch - Model.start_pitch] = [0, 1]
-                data_out[example, start_frame, note.pitch - Model.start_pitch] = [1, 0]
+            elif action == "pause":  # add a pause
+                current_time += DataGenerator.sample_frequency * DataGenerator.pause_duration * (1 + .5 * advance_draw)
 
-            signal *= volume  # apply the volume
+        return events[:count], noises, volume
 
-            emphasized_signal = np.append(signal[0], signal[1:] - Model.pre_emphasis * signal[:-1])
-            # this is a simple noise filter
+    def draw_actions(self):
+        """
+        Draws everything that is random about the next block of actions in an example at once. Each row is the action
+        when there isn't and when there is a chord to repeat, the chord for each guitar, the guitar to swap to, then
+        uniforms for the length, the pitch and how far the time moves on, and a normal for the volume.
+        """
+        block = DataGenerator.action_block
+        actions = [np.array(DataGenerator.actions)[sampler.draw(block)].tolist() for sampler in self.action_samplers]
+        chords = zip(*[sampler.draw(block).tolist() for sampler in self.chord_samplers])
 
-            pad_signal_length = num_frames * Model.frame_step + Model.frame_length
-            z = np.zeros((pad_signal_length - Model.frame_length))
-            pad_signal = np.append(emphasized_signal, z)
-
-            indices = np.tile(np.arange(0, Model.frame_length), (num_frames, 1)) + np.tile(
-                np.arange(0, num_frames * Model.frame_step, Model.frame_step), (Model.frame_length, 1)).T
-            frames = pad_signal[indices.astype(np.int32, copy=False)]
-            # this splits the signal into frames
-
-            frames *= np.hamming(Model.frame_length)
-            # applys the hamming window
-
-            mag_frames = np.absolute(np.fft.rfft(frames, Model.frame_length))  # Magnitude of the FFT
-            pow_frames = (mag_frames ** 2) / Model.frame_length  # Power Spectrum
-
-            filter_banks = np.dot(pow_frames, Model.f_bank)
-            filter_banks = np.where(filter_banks == 0, np.finfo(float).eps, filter_banks)
-            # doesn't allow for 0 to increase stability. i.e. no dividing by zero
-            filter_banks = np.log(filter_banks)
-            # puts the magnitudes onto a logarithmic scale
-
-            data_in[example] = filter_banks
-
-            if example < 10 and False:  # this is just for debugging
-                print(example)
-                scipy.io.wavfile.write("trash/test" + str(example)
-                                       + ".wav", 44100, signal)
-                with open("trash/test" + str(example) + "log.txt", "w") as file:
-                    file.write("DATA\n")
-                    file.write("NOTES\n")
-                    for note in notes:
-                        if note.origin[0:4] == "res-":
-                            continue
-                        file.write(str(note) + "\n")
-                    file.write("NOISE\n")
-                    for note in noises:
-                        file.write(str(note) + "\n")
-
-                plt.imshow(np.transpose(data_in[example]), cmap='nipy_spectral', interpolation='nearest')
-                plt.colorbar()
-                plt.show()
-
-                plt.imshow(np.transpose(data_out[example, :, :, 1]), cmap='nipy_spectral', interpolation='nearest')
-                plt.colorbar()
-                plt.show()
-
-        return np.reshape(data_in, [Trainer.batch_size, num_frames, Model.mel_filters, 1]), data_out
-
-    @staticmethod
-    def make_resonances(note):
-        """
-        This method is for making resonances of a note.
-        When a note is played it isn't just one frequency.  To compensate for the lacking training data, I play notes at
-        common ratios, which this function generates.
-        """
-        notes = []
-        for i in range(DataGenerator.resonance_amount):
-            new = Note(note.start_time,
-                       min(DataGenerator.note_duration_max * DataGenerator.sample_frequency,
-                           Trainer.example_length - note.start_time),
-                       note.pitch + choice([-12, -4, -3, 3, 4, 12]),
-                       note.roll,
-                       note.guitar,
-                       note.volume * gauss(DataGenerator.resonance_volume_mean,
-                                           DataGenerator.resonance_volume_sd),
-                       note.output_delay,
-                       "res-" + note.origin,
-                       outs=False)
-            if note.pitch in range(Model.start_pitch, Model.end_pitch):
-                notes.append(new)
-        return []
+        return list(zip(*actions, chords, self.guitar_sampler.draw(block).tolist(),
+                        *np.random.random((3, block)).tolist(), np.random.standard_normal(block).tolist()))
 
-    def get_batch(self):
-        """Fetches a batch from the queue or waits for one to be available"""
-        while self.queue.empty():
-            time.sleep(.1)
-        return self.queue.get()
+    @staticmethod
+    def draw_notes(size):
+        """
+        Draws what is random about each of the notes of an example, by their position in the events. This is how much
+        earlier they are cut off, their roll and how late they are played in a chord.
+        """
+        jitters = np.random.uniform(0, 500, size)
+        rolls = np.random.randint(-DataGenerator.roll, DataGenerator.roll, size)
+        delays = np.random.normal(0, DataGenerator.chord_delay_sd, size)
+        return jitters, rolls, delays
 
-    def __del__(self):
-        """When the object is unloaded"""
-        self.thread.stop()
-        self.thread.join()
+    def grow_events(self):
+        """Doubles the space for the notes of an example, keeping the ones that are already in it"""
+        self.events = np.concatenate([self.events, np.zeros_like(self.events)])
+        return self.events
+
+    def render_events(self, signal, labels, events):
+        """Renders the notes of an example from schedule_example, see render_notes"""
+        self.render_notes(signal, labels, events["start"], events["duration"], events["pitch"], events["roll"],
+                          events["volume"], events["guitar"])
+
+    @staticmethod
+    def mix_noise(signal, noise_data, start_offset, volume):
+        """
+        Adds a looping noise to the signal, where the loop is shifted along by start_offset samples. The loop is read
+        straight into the signal one repetition at a time, so the noise is never tiled or rolled into full copies.
+        """
+        position = 0
+        source = -start_offset % noise_data.length
+        while position < signal.size:
+            length = min(noise_data.length - source, signal.size - position)
+            signal[position:position + length] += volume * noise_data.data[source:source + length]
+            position += length
+            source = 0
+
+    def render_notes(self, signal, labels, starts, durations, pitches, rolls, volumes, guitars):
+        """
+        Adds notes to the signal of an example and marks them in its labels. The notes are given as arrays with one
+        entry for each note, where the guitars are indices into self.guitars. The labels are [frames, pitches] and 1
+        where a note is on. The labels of all of the notes are marked together, and the samples are added straight
+        from the guitar's data. Notes that don't finish before the last frame are left out.
+        """
+        num_frames = labels.shape[0]
+        output_delay = DataGenerator.lstm_delay * Model.samples_per_dft
+
+        start_frames = ((starts + output_delay) * Model.dft_rate / DataGenerator.sample_frequency).astype(np.int64)
+        end_frames = np.minimum(((starts + durations + output_delay) * Model.dft_rate /
+                                 DataGenerator.sample_frequency).astype(np.int64), num_frames)
+
+        kept = end_frames < num_frames
+        starts, durations, pitches, rolls, volumes, guitars, start_frames, end_frames = \
+            starts[kept], np.maximum(durations[kept], 0), pitches[kept], rolls[kept], volumes[kept], guitars[kept], \
+            start_frames[kept], end_frames[kept]
+
+        if len(starts) == 0:
+            return
+
+        data_starts = [self.guitars[guitar].pitch_offsets[pitch - Model.start_pitch]
+                       for guitar, pitch in zip(guitars, pitches)]
+
+        for start, duration, roll, volume, guitar, data_start in zip(starts.tolist(), durations.tolist(),
+                                                                      rolls.tolist(), volumes.astype(np.float32),
+                                                                      guitars.tolist(), data_starts):
+            # each note is added as two slices, which is the same as adding np.roll of it but without the copy
+            data = self.guitars[guitar].data[data_start:data_start + duration]
+            roll %= max(duration, 1)
+            signal[start:start + roll] += volume * data[duration - roll:]
+            signal[start + roll:start + duration] += volume * data[:duration - roll]
+
+        # each frame takes the label of the last note that covers it, which is the on label unless it is the note's
+        # first frame
+        covered = np.maximum(end_frames, start_frames + 1) - start_frames
+        note_of_frame = np.repeat(np.arange(len(starts)), covered)
+        frames = start_frames[note_of_frame] + np.arange(note_of_frame.size) - (np.cumsum(covered) - covered)[
+            note_of_frame]
+        last_note = np.full(labels.shape, -1, np.int64)
+        np.maximum.at(last_note, (frames, pitches[note_of_frame] - Model.start_pitch), note_of_frame)
+
+        is_written = last_note >= 0
+        is_on = is_written & (np.arange(num_frames)[:, np.newaxis] != start_frames[last_note])
+        labels[is_written] = 0
+        labels[is_on] = 1
+
+    def get_batch(self):
+        """Generates a batch in the calling thread, see GeneratorPool for generating them in the background"""
+        return self.generate_batch
 
     @staticmethod
     def load_sound_from(folder):
-        """This loads all of the sounds in a given directory and creates SoundData objects out of them"""
+        """
+        This loads all of the sounds in a given directory and creates SoundData objects out of them.
+        If the sounds have been put into a sound bank then they are memory mapped from there instead.
+        """
+        bank = DataGenerator.load_sound_bank(folder)
+        if bank is not None:
+            return bank
+
+        return DataGenerator.load_sound_from_wavs(folder)
+
+    @staticmethod
+    def sound_bank_index(folder):
+        """The path of the index of the sound bank of a folder"""
+        return os.path.join(DataGenerator.sound_bank_folder, os.path.basename(os.path.normpath(folder)), "index.json")
+
+    @staticmethod
+    def build_sound_bank(folder):
+        """
+        Decodes and normalises the sounds of a folder and saves them as raw float32 files, with an index that stores
+        where each pitch's note starts. Loading the bank is then just memory mapping the files, and all of the
+        processes that map the same file share its memory.
+        """
+        sounds = DataGenerator.load_sound_from_wavs(folder)
+        index_path = DataGenerator.sound_bank_index(folder)
+        bank_folder = os.path.dirname(index_path)
+        os.makedirs(bank_folder, exist_ok=True)
+
+        entries = []
+        for sound in sounds:
+            file_name = os.path.basename(sound.file_path)
+            data_name = file_name[:-len(".wav")] + ".f32"
+            sound.data.astype(np.float32).tofile(os.path.join(bank_folder, data_name))
+
+            entries.append({
+                "file_path": sound.file_path,
+                "wav_size": os.path.getsize(sound.file_path),
+                "wav_modified": os.path.getmtime(sound.file_path),
+                "data": data_name,
+                "length": sound.length,
+                "rms": float(sound.rms),
+                "pitch_offsets": None if sound.range is None else sound.pitch_offsets.tolist()
+            })
+
+        with open(index_path, "w") as file:
+            json.dump({"sample_frequency": DataGenerator.sample_frequency, "sounds": entries}, file, indent=2)
+
+        print("Saved " + str(len(entries)) + " sounds from " + folder + " to " + bank_folder)
+
+    @staticmethod
+    def load_sound_from_wavs(folder):
+        """Loads the sounds of a folder from their wav files, ignoring the sound bank"""
         sounds = tuple(
             (SoundData(folder + "/" + file_name) for file_name in os.listdir(folder) if file_name.endswith(".wav")))
 
@@ -350,21 +897,30 @@ class DataGenerator:
         return sounds
 
     @staticmethod
-    def weighted_choice(choices):
-        """
-        This makes a weighted random choice
-        e.g. red with 2/5 chance and green with 3/5 chance would be,
-        weighted_choice( {"red": 2, "green": 3} )
-        """
-        weight_sum = sum(w for c, w in choices.items())
-
-        value = uniform(0, weight_sum)
-
-        counter = 0
-        for c, w in choices.items():
-            if counter + w >= value:
-                return c
-            counter += w
+    def load_sound_bank(folder):
+        """Memory maps the sound bank of a folder, if the bank is missing or out of date then None is returned"""
+        index_path = DataGenerator.sound_bank_index(folder)
+        if not os.path.exists(index_path):
+            return None
+
+        with open(index_path) as file:
+            index = json.load(file)
+
+        # a sample that is recorded again at the same length has the same size, so the modification time is checked too
+        wavs = set(folder + "/" + file_name for file_name in os.listdir(folder) if file_name.endswith(".wav"))
+        if wavs != set(entry["file_path"] for entry in index["sounds"]) or \
+                any(os.path.getsize(entry["file_path"]) != entry["wav_size"] or
+                    os.path.getmtime(entry["file_path"]) != entry.get("wav_modified") for entry in index["sounds"]):
+            print("The sound bank of " + folder + " is out of date so the wav files are loaded instead")
+            return None
+
+        bank_folder = os.path.dirname(index_path)
+        return tuple(SoundData(entry["file_path"],
+                               np.memmap(os.path.join(bank_folder, entry["data"]), np.float32, "r",
+                                         shape=(entry["length"],)),
+                               entry["rms"],
+                               entry["pitch_offsets"])
+                     for entry in index["sounds"])
 
     @staticmethod
     def hz_to_mel(freq):
@@ -382,8 +938,47 @@ class DataGenerator:
         return 27.5 * (20 ** (1 / 12)) ** (pitch - 9)
 
     @staticmethod
-    def load_chords():
-        """Loads all the possible chords"""
+    def load_chords(file_path=None):
+        """Loads all the possible chords from the chord library"""
+        file_path = DataGenerator.chords_file if file_path is None else file_path
+
+        with open(file_path) as file:
+            library = json.load(file)
+
+        return [Chord(name, notes, weight) for name, notes, weight in library["chords"]]
+
+    @staticmethod
+    def refresh_chords(file_path=None):
+        """
+        Rebuilds the chord library, this is the only time that the chords are downloaded so the training itself doesn't
+        need a connection
+        """
+        file_path = DataGenerator.chords_file if file_path is None else file_path
+
+        try:
+            with open(file_path) as file:
+                version = json.load(file)["version"] + 1
+        except (OSError, ValueError, KeyError):
+            version = 1
+
+        chords = DataGenerator.generate_chords() + DataGenerator.download_chords()
+
+        DataGenerator.save_chords(file_path, chords, version, DataGenerator.chords_url)
+
+        print("Saved " + str(len(chords)) + " chords to " + file_path + " as version " + str(version))
+
+    @staticmethod
+    def save_chords(file_path, chords, version, source):
+        """Saves the chord library, with one chord on each line so that the changes between versions are readable"""
+        with open(file_path, "w") as file:
+            file.write("{\"version\": " + json.dumps(version) + ", \"source\": " + json.dumps(source) +
+                       ", \"chords\": [\n")
+            file.write(",\n".join(json.dumps([chord.name, chord.notes, chord.weight]) for chord in chords))
+            file.write("\n]}\n")
+
+    @staticmethod
+    def generate_chords():
+        """Generates the common chord types for every root note"""
 
         chord_types = [["maj", [0, 4, 7], 30],
                        ["min", [0, 3, 7], 30],
@@ -403,13 +998,21 @@ class DataGenerator:
                     notes = list(map(lambda x: x + root + octave * 12, chord_type[1]))
                     chords.append(Chord(root_letters[i] + chord_type[0] + str(octave), notes, chord_type[2]))
 
-        # this section loads the chords that are actually played on a guitar, since unlike the ones above, guitar chords
-        # usually consist of more than 3 notes
-        raw_chord_data = urllib.request.urlopen("http://www.chordie.com/chords.php").read()
+        return chords
+
+    @staticmethod
+    def download_chords():
+        """
+        This downloads the chords that are actually played on a guitar, since unlike the generated ones, guitar chords
+        usually consist of more than 3 notes
+        """
+        raw_chord_data = urllib.request.urlopen(DataGenerator.chords_url).read()
         chord_matches = re.findall(r'title="[^".]*"', str(raw_chord_data))
         chord_data = map(lambda raw_chord: raw_chord[7:-1].split("="), chord_matches)
         standard_tuning = [28, 33, 38, 43, 47, 52]
 
+        chords = []
+
         for chord in chord_data:
             name = chord[0]
             chord_notes = []
@@ -422,42 +1025,388 @@ class DataGenerator:
         return chords
 
 
-class GeneratorThread(threading.Thread):
+class GeneratorPool:
     """
-    The point of this thread is to optimise the training time
+    The point of this pool is to optimise the training time
+
+    When TensorFlow is using a training batch, the worker processes of this pool use the rest of the processor for
+    generating the next batches.  Each worker is a separate process with its own DataGenerator, so unlike a thread the
+    generation isn't held back by the GIL and the throughput scales with the amount of cores.  The queue holds at most
+    `prefetch` batches so that the workers can't run too far ahead of the training and use up all of the memory.
 
-    When TensorFlow is using a training batch(on the GPU), this thread uses the processor for generating the next batch.
-    This means that the there is much less time between one epoch of learning and another.  When this thread is used the
-    only delay between training batches is the time it takes to move the new batch into memory. In effect this makes a
-    large impact especially on large batch sizes.
+    The workers also collect the feature statistics of their first batches and send them along with the batches, so
+    the statistics are collected in parallel and only have to be merged. The batches that they were collected from are
+    kept until the training reads them, rather than being thrown away.
     """
+    workers = max(1, multiprocessing.cpu_count() - 1)
+    prefetch = 4
+
+    def __init__(self, workers=None, prefetch=None, seed=None):
+        self.workers = GeneratorPool.workers if workers is None else workers
+        self.prefetch = GeneratorPool.prefetch if prefetch is None else prefetch
+        self.seed = randrange(0, 2 ** 31) if seed is None else seed
+        self.feature_dtype = DataGenerator.feature_dtype
+        self.statistics = None  # these are collected from the first batches by collect_statistics
+        self.collected_batches = []  # the batches that the statistics were collected from, in the order they came
+        self.example_length = multiprocessing.Value("q", Trainer.example_length)
+        # this is shared with the workers, so that they can all change the length of their examples
+
+        self.queue = multiprocessing.Queue(self.prefetch)
+        self.stop_event = multiprocessing.Event()
+        self.processes = [
+            multiprocessing.Process(target=GeneratorPool.run_worker,
+                                    args=(self.seed + worker, self.queue, self.stop_event, self.feature_dtype,
+                                          self.example_length, self.prefetch, FeatureStatistics.warmup_batches,
+                                          Trainer.batch_size),
+                                    name="Generator-" + str(worker),
+                                    daemon=True)
+            for worker in range(self.workers)]
+        # every worker gets its own seed so that no two workers generate the same examples
+
+        for process in self.processes:
+            process.start()
 
-    def __init__(self, data):
-        super(GeneratorThread, self).__init__(name="Generator")
-        self.data = data
-        self.should_stop = False
+    @staticmethod
+    def run_worker(worker_seed, queue, stop_event, feature_dtype, example_length, prefetch, statistics_batches,
+                   batch_size):
+        """
+        This is what each of the worker processes runs, it keeps generating batches until the pool is stopped. The
+        first statistics_batches batches are sent with their feature statistics, and the rest with None.
+        """
+        seed(worker_seed)
+        np.random.seed(worker_seed % 2 ** 32)
+        DataGenerator.feature_dtype = feature_dtype
+        Trainer.batch_size = batch_size
+        GeneratorWorkspace.slots = max(GeneratorWorkspace.slots, prefetch + 2)
+        # a batch in the queue is only copied into the pipe later, so its arrays can't be reused until it's been read
 
-    def run(self):
-        while not self.should_stop:
-            while (not self.data.queue.empty()) and (not self.should_stop):
-                time.sleep(.1)
-            self.data.queue.put(self.data.generate_batch)
+        data_generator = DataGenerator()
+
+        while not stop_event.is_set():
+            if example_length.value != data_generator.example_length:
+                data_generator.set_example_length(example_length.value)
+            data_in, data_out = data_generator.generate_batch
+            statistics = None
+            if statistics_batches > 0:
+                statistics = FeatureStatistics()
+                statistics.update(data_in)
+                statistics_batches -= 1
+            batch = data_in, data_out, statistics
+
+            while not stop_event.is_set():
+                try:
+                    queue.put(batch, timeout=.5)
+                    break
+                except Full:
+                    pass
+                    # the timeout means that a full queue can't stop the worker from noticing that it should stop
+
+        data_generator.profiler.report()
+
+    def get_batch(self):
+        """Fetches a batch from the queue or waits for one to be available"""
+        if len(self.collected_batches) != 0:
+            return self.collected_batches.pop(0)
+        data_in, data_out, _ = self.next_batch()
+        return data_in, data_out
+
+    def next_batch(self):
+        """Fetches a batch from the queue along with its statistics, if it has any"""
+        while True:
+            try:
+                return self.queue.get(timeout=1)
+            except Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    raise RuntimeError("All of the generator processes have stopped")
+
+    def collect_statistics(self, batches=None):
+        """Merges the feature statistics that the workers sent with the next few batches"""
+        batches = FeatureStatistics.warmup_batches if batches is None else batches
+        self.statistics = FeatureStatistics()
+
+        print("Collecting the feature statistics from " + str(batches) + " batches")
+        while len(self.collected_batches) < batches:
+            data_in, data_out, statistics = self.next_batch()
+            if statistics is None:
+                statistics = FeatureStatistics()
+                statistics.update(data_in)
+                # only the first few batches of each worker are sent with their statistics
+            self.statistics.merge(statistics)
+            self.collected_batches.append((data_in, data_out))
+        return self.statistics
+
+    def set_example_length(self, example_length):
+        """Makes the workers generate examples of this many samples, the batches already in the queue are kept"""
+        self.example_length.value = example_length
 
     def stop(self):
-        self.should_stop = True
+        """Stops all of the workers and waits for them to finish"""
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+
+        for process in self.processes:
+            while process.is_alive():
+                try:
+                    self.queue.get(timeout=.1)
+                    # a worker can't exit while the batch it put in the queue hasn't been flushed into the pipe
+                except Empty:
+                    process.join(.1)
+
+        self.queue.close()
+        self.queue.join_thread()
+
+    def __del__(self):
+        """When the object is unloaded"""
+        self.stop()
+
+
+class ShardedDataset:
+    """
+    This class is for training from batches that were generated ahead of time and stored on disk
+
+    Generating the batches is by far the slowest part of training, so they can instead be generated once(on as many
+    cores as are available) and then reused by any amount of training runs. The batches are stored in shards, each of
+    which is a pair of .npy files that hold the inputs and outputs of several batches, and a manifest which describes
+    how they were made. The shards are memory mapped, so reading a batch costs no more than reading it from disk.
+
+    The labels are stored as uint8, but datasets from version 1 which stored them as the float one hot pairs can
+    still be read. An augmenter can be given to change every batch as it is read, so that each stored example can be
+    reused many times without being the same each time.
+    """
+    manifest_name = "manifest.json"
+    version = 2
+    supported_versions = [1, 2]
+    shard_size = 32  # in batches
+
+    generator = None  # the DataGenerator of a precompute worker
+
+    def __init__(self, directory, shuffle=True, seed=None, augmenter=None, any_batch_size=False):
+        self.directory = directory
+        self.shuffle = shuffle
+        self.random = Random(seed)
+        self.augmenter = augmenter
+
+        with open(os.path.join(directory, ShardedDataset.manifest_name)) as file:
+            self.manifest = json.load(file)
+
+        if self.manifest["version"] not in ShardedDataset.supported_versions:
+            raise ValueError("Unsupported dataset version " + str(self.manifest["version"]))
+        if not any_batch_size and self.manifest["batch_size"] != Trainer.batch_size:
+            raise ValueError("The dataset in " + directory + " has batches of " + str(self.manifest["batch_size"]) +
+                             " examples, but the training uses batches of " + str(Trainer.batch_size))
+            # otherwise the batches would only be found to be the wrong shape once they are in the graph
+
+        self.shards = [(np.load(os.path.join(directory, shard["data_in"]), mmap_mode="r"),
+                        np.load(os.path.join(directory, shard["data_out"]), mmap_mode="r"))
+                       for shard in self.manifest["shards"]]
+        self.feature_dtype = self.shards[0][0].dtype
+
+        self.statistics = None
+        if all("statistics" in shard for shard in self.manifest["shards"]):
+            self.statistics = FeatureStatistics()
+            for shard in self.manifest["shards"]:
+                self.statistics.merge(FeatureStatistics.from_json(shard["statistics"]))
+        # the statistics of each shard were collected as it was generated, so they only have to be merged
+
+        self.order = []  # the batches that haven't been used in this pass over the dataset
+        self.num_frames = None  # the batches are cut down to this many frames, when it is set
+
+    def __len__(self):
+        return self.manifest["batches"]
+
+    def get_batch(self):
+        """Reads the next batch, once all of the batches have been used the dataset is passed over again"""
+        if len(self.order) == 0:
+            self.order = [(shard, batch) for shard, (data_in, _) in enumerate(self.shards)
+                          for batch in range(data_in.shape[0])]
+            if self.shuffle:
+                self.random.shuffle(self.order)
+            self.order.reverse()  # batches are popped from the end
+
+        shard, batch = self.order.pop()
+        data_in, data_out = self.shards[shard]
+        frames = slice(self.num_frames)
+        if self.manifest["version"] == 1:
+            data = np.array(data_in[batch, :, frames]), data_out[batch, :, frames, :, 1].astype(np.uint8)
+        else:
+            data = np.array(data_in[batch, :, frames]), np.array(data_out[batch, :, frames])
+
+        if self.augmenter is not None:
+            return self.augmenter(*data)
+        return data
+
+    def set_example_length(self, example_length):
+        """
+        Makes the batches shorter by only reading the start of each example. Examples can't be made longer than they
+        were generated.
+        """
+        self.num_frames = Model.frames_for(example_length)
+
+    @staticmethod
+    def precompute(directory, batches, seed=0, shard_size=None, workers=None):
+        """
+        Generates the batches and writes them into the directory. Every shard is generated with its own seed that is
+        derived from the seed of the dataset, so the same seed always produces the same dataset no matter how many
+        workers are used.
+        """
+        shard_size = ShardedDataset.shard_size if shard_size is None else shard_size
+        workers = GeneratorPool.workers if workers is None else workers
+
+        os.makedirs(directory, exist_ok=True)
+
+        jobs = [(directory, seed, shard, min(shard_size, batches - shard * shard_size))
+                for shard in range(int(math.ceil(batches / shard_size)))]
+
+        print("Generating " + str(batches) + " batches in " + str(len(jobs)) + " shards")
+        with multiprocessing.Pool(workers, ShardedDataset.init_worker,
+                                  (DataGenerator.feature_dtype, Trainer.batch_size)) as pool:
+            shards = pool.map(ShardedDataset.render_shard, jobs, chunksize=1)
+
+        manifest = {
+            "version": ShardedDataset.version,
+            "seed": seed,
+            "batches": batches,
+            "batch_size": Trainer.batch_size,
+            "example_length": Trainer.example_length,
+            "mel_filters": Model.mel_filters,
+            "start_pitch": Model.start_pitch,
+            "end_pitch": Model.end_pitch,
+            "feature_dtype": np.dtype(DataGenerator.feature_dtype).name,
+            "shards": shards
+        }
+        with open(os.path.join(directory, ShardedDataset.manifest_name), "w") as file:
+            json.dump(manifest, file, indent=2)
+        print("Finished generating the dataset in " + directory)
+
+    @staticmethod
+    def init_worker(feature_dtype, batch_size):
+        """Creates the DataGenerator of a precompute worker"""
+        DataGenerator.feature_dtype = feature_dtype
+        Trainer.batch_size = batch_size
+        ShardedDataset.generator = DataGenerator()
+
+    @staticmethod
+    def render_shard(job):
+        """Generates one shard and writes it to disk, returning its entry in the manifest"""
+        directory, dataset_seed, shard, size = job
+
+        shard_seed = dataset_seed * 1000003 + shard
+        seed(shard_seed)
+        np.random.seed(shard_seed % 2 ** 32)
+
+        name = "shard{0:05d}".format(shard)
+        data_in_name = name + "_in.npy"
+        data_out_name = name + "_out.npy"
+        data_in_file = None
+        data_out_file = None
+        statistics = FeatureStatistics()
+
+        for batch in range(size):
+            data_in, data_out = ShardedDataset.generator.generate_batch
+            statistics.update(data_in)
+
+            if data_in_file is None:
+                # the files are written batch by batch so that the whole shard never has to be in memory
+                data_in_file = np.lib.format.open_memmap(os.path.join(directory, data_in_name), "w+",
+                                                         data_in.dtype, (size,) + data_in.shape)
+                data_out_file = np.lib.format.open_memmap(os.path.join(directory, data_out_name), "w+",
+                                                          data_out.dtype, (size,) + data_out.shape)
+            data_in_file[batch] = data_in
+            data_out_file[batch] = data_out
+
+        data_in_file.flush()
+        data_out_file.flush()
+        del data_in_file, data_out_file
+
+        ShardedDataset.generator.profiler.report()
+
+        return {"data_in": data_in_name, "data_out": data_out_name, "batches": size, "seed": shard_seed,
+                "statistics": statistics.to_json()}
+
+
+class FeatureAugmenter:
+    """
+    This class makes new examples out of generated ones, by changing their log mel frames and their labels to match
+
+    Each example gets a random change in gain, which is a constant added to its log mel frames, and is shifted along
+    the mel bins by a fraction of a bin, which is too little to change the pitches of its notes. Some of the examples
+    have a stretch of frames masked to the quietest level of the example, where the notes are then labelled as off, and
+    some are mixed with another example of the batch, where the powers add up and the notes of both are on. Everything
+    is done to the whole batch at once, so it costs almost nothing next to generating a batch.
+    """
+    max_gain = 6  # in decibels, either way
+    max_bin_shift = .25  # in mel bins, either way
+    mask_probability = .3
+    max_mask_frames = 30
+    mix_probability = .3
+    max_mix_attenuation = 12  # in decibels, how much quieter the example that is mixed in can be
+
+    def __init__(self, seed=None):
+        self.random = np.random.RandomState(seed)
+
+    def __call__(self, data_in, data_out):
+        """Augments a batch of log mel frames, [batch, frames, mel_filters, 1], and its labels, [batch, frames, 36]"""
+        dtype = data_in.dtype
+        features = data_in[..., 0].astype(np.float32)
+        labels = data_out.copy()
+        batch_size, num_frames, mel_filters = features.shape
+
+        gains = self.random.uniform(-FeatureAugmenter.max_gain, FeatureAugmenter.max_gain, batch_size)
+        features += self.decibels_to_log_power(gains)[:, None, None]
+
+        features = self.shift(features, self.random.uniform(-FeatureAugmenter.max_bin_shift,
+                                                            FeatureAugmenter.max_bin_shift, batch_size))
+
+        masked = self.random.random_sample(batch_size) < FeatureAugmenter.mask_probability
+        lengths = self.random.randint(1, FeatureAugmenter.max_mask_frames + 1, batch_size) * masked
+        starts = self.random.randint(0, num_frames, batch_size)
+        mask = (np.arange(num_frames) >= starts[:, None]) & (np.arange(num_frames) < (starts + lengths)[:, None])
+        features = np.where(mask[:, :, None], np.min(features, (1, 2))[:, None, None], features)
+        labels[mask] = 0
+
+        mixed = self.random.random_sample(batch_size) < FeatureAugmenter.mix_probability
+        partners = self.random.permutation(batch_size)
+        attenuations = self.decibels_to_log_power(-self.random.uniform(0, FeatureAugmenter.max_mix_attenuation,
+                                                                       batch_size))
+        features[mixed] = np.logaddexp(features[mixed], features[partners[mixed]] + attenuations[mixed, None, None])
+        labels[mixed] |= labels[partners[mixed]]
+        # the partners are read before anything is written, so an example is never mixed with an already mixed one
+
+        return features[..., np.newaxis].astype(dtype, copy=False), labels
+
+    @staticmethod
+    def decibels_to_log_power(decibels):
+        """The amount that a change in decibels adds to the natural log of a power"""
+        return decibels * np.log(10) / 10
+
+    @staticmethod
+    def shift(features, shifts):
+        """Shifts the frames of each example along the mel bins by a fraction of a bin, with linear interpolation"""
+        mel_filters = features.shape[2]
+        positions = np.clip(np.arange(mel_filters) + shifts[:, None], 0, mel_filters - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, mel_filters - 1)
+        fractions = (positions - lower)[:, None, :].astype(np.float32)
+
+        return (np.take_along_axis(features, lower[:, None, :], 2) * (1 - fractions) +
+                np.take_along_axis(features, upper[:, None, :], 2) * fractions)
 
 
 class SoundData:
     """This class os for storing the sound data related to guitars and instruments"""
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, data=None, rms=None, pitch_offsets=None):
         self.file_path = file_path
-        _, self.data = scipy.io.wavfile.read(file_path)  # sample frequency is disregarded since it will be constant
-        if len(self.data.shape) > 1:
-            self.data = self.data[:, 0]  # select only one chanel of sound
+        if data is None:
+            _, data = scipy.io.wavfile.read(file_path)  # sample frequency is disregarded since it will be constant
+            if len(data.shape) > 1:
+                data = data[:, 0]  # select only one chanel of sound
+            data = data.astype(np.float32)
+        self.data = data
         self.length = self.data.shape[0]  # in samples
 
-        self.rms = np.sqrt(np.mean(self.data ** 2))
+        self.rms = np.sqrt(np.mean(np.square(self.data, dtype=np.float64))) if rms is None else rms
 
         range_matches = re.findall(r"\[[\d]*-[\d]*\]", file_path)
         if len(range_matches) == 1:
@@ -470,6 +1419,12 @@ class SoundData:
         else:
             self.range = None
 
+        if pitch_offsets is None:
+            pitch_offsets = np.arange(Model.end_pitch - Model.start_pitch) * DataGenerator.note_duration_max * \
+                            DataGenerator.sample_frequency
+        self.pitch_offsets = np.asarray(pitch_offsets, np.int64)
+        # where the recording of each pitch starts in the data, the pitches are indexed from Model.start_pitch
+
     def __str__(self):
         return "SoundData{" + \
                "file_path='" + self.file_path.split("/")[-1] + "'" + \
@@ -493,32 +1448,6 @@ class Chord:
                "}"
 
 
-class Note:
-    """This class stores the instance of a played note that exists within one generated example"""
-
-    def __init__(self, start_time, duration, pitch, roll, guitar, volume, output_delay, origin, outs=True):
-        self.start_time = int(start_time)
-        self.duration = int(duration)
-        self.pitch = pitch
-        self.roll = roll
-        self.guitar = guitar
-        self.volume = volume
-        self.output_delay = output_delay
-        self.origin = origin
-        self.outs = outs
-
-    def __str__(self):
-        return "Note{" + \
-               ", start_time=" + str(round(self.start_time / DataGenerator.sample_frequency, 2)) + \
-               ", duration=" + str(round(self.duration / DataGenerator.sample_frequency, 2)) + \
-               ", pitch=" + str(self.pitch) + \
-               ", guitar=" + str(self.guitar) + \
-               ", volume=" + str(self.volume) + \
-               ", origin=" + str(self.origin) + \
-               ", output_delay=" + str(self.output_delay) + \
-               "}"
-
-
 class Noise:
     """This class is for storing the different types of noise that exist"""
 
@@ -543,21 +1472,32 @@ class Trainer:
     batch_size = 6  # 10
     learning_rate = 0.000005
 
-    def __init__(self, data_generator, model):
+    epochs = 50000
+    iterations = 70  # the amount of training steps that are made on each batch
+
+    validation_folder = None  # where the validation set is cached, None to not evaluate the saves
+    # the validation set is loaded by run_training, before anything else is started
+
+    curriculum = None
+    # [(epoch, example length in seconds), ...], the examples are made that long from the epoch onwards, so that the
+    # training can start on short examples which make faster steps
+
+    towers = 1  # the amount of copies of the model that each batch is split between
+    accumulation_steps = 1  # the amount of batches whose gradients are added up for each update of the weights
+
+    def __init__(self, data_generator, model, validation_set=None):
         self.data_generator = data_generator
         self.model = model
+        self.validation_set = validation_set  # the inputs and labels that the saves are evaluated on, if any
+        self.checkpoints = CheckpointManager(model)
 
-        self.epochs = 50000
-        self.iterations = 70
+        self.epochs = Trainer.epochs
+        self.iterations = Trainer.iterations
 
     def train(self, session, continue_training, log_file=""):
         """This function trains the model"""
         print("Starting Training")
 
-        console_form = "Epoch: {0:" + str(len(str(self.epochs))) + "d}/" + str(self.epochs) + " Iteration: {1:" + str(
-            len(str(self.iterations))) + "d}/" + str(self.iterations) + " Cost: {2:0.15f}"
-        log_form = "{0}, {1}, {2}, {3}\n"
-
         if continue_training:
             try:
                 self.model.load_from_save(session)
@@ -565,34 +1505,373 @@ class Trainer:
                 print("Failed to load previous model")
                 continue_training = False
 
-        if len(log_file) != 0:
-            log_file = open(log_file, "a" if continue_training else "w")
-        else:
-            log_file = None
+        metrics = TrainingMetrics(self.model, self.epochs, self.iterations, log_file, continue_training)
+        evaluator = None
+        if self.validation_set is not None:
+            evaluator = Evaluator(self.validation_set, self.model.statistics, append=continue_training)
+        step = 0
+        if continue_training:
+            # the steps carry on from the save, so that the new saves don't take the names of the old ones
+            step = Model.save_step(Model.latest_save())
+            self.checkpoints.resume(step)
 
         for epoch in range(self.epochs):
 
-            x, y = self.data_generator.get_batch()
-            session.run(self.model.init_data_x, feed_dict={self.model.in_data_x: x})
-            session.run(self.model.init_data_y, feed_dict={self.model.in_data_y: y})
-            # feed_dict = {start_state: zero_state.eval()}  # keep_prob_placeholder: keep_prob
+            if Trainer.curriculum is not None:
+                self.follow_curriculum(epoch)
 
+            # the batches are read by the model's input pipeline, which moves onto the next batch after every
+            # Trainer.iterations steps
             for iteration in range(self.iterations):
-                session.run(self.model.train_step)
-                current_cost = session.run(self.model.cost)
+                start_time = time.time()
+                current_cost = self.model.run_train_step(session)
+                # the cost is the one of the forward passes that the training step used
 
-                print(console_form.format((epoch + 1), (iteration + 1), current_cost))
-                if log_file is not None:
-                    log_file.write(log_form.format(epoch, iteration, current_cost, time.time()))
+                metrics.record(epoch, iteration, current_cost, time.time() - start_time)
 
-            if log_file is not None:
-                log_file.flush()
-            self.model.save(session)
+                step += 1
+                self.checkpoints.step(session, step)
 
-        if log_file is not None:
-            log_file.close()
+        self.checkpoints.close(session, step)
+        metrics.close()
+        if evaluator is not None:
+            evaluator.close()
         print("Finished training")
 
+    def follow_curriculum(self, epoch):
+        """Changes the length of the examples when the curriculum says to at this epoch"""
+        for start_epoch, seconds in Trainer.curriculum:
+            if start_epoch == epoch:
+                print("Training on examples of " + str(seconds) + " seconds")
+                self.data_generator.set_example_length(int(seconds * DataGenerator.sample_frequency))
+
+    @staticmethod
+    def parse_curriculum(text):
+        """Reads a curriculum that is written as epoch:seconds pairs, e.g. 0:5,200:10,500:20"""
+        curriculum = []
+        for stage in text.split(","):
+            epoch, seconds = stage.split(":")
+            curriculum.append((int(epoch), float(seconds)))
+        return sorted(curriculum)
+
+
+class CheckpointManager:
+    """
+    This class saves the state of the training regularly without stopping the training
+
+    The saves are made from a snapshot of the variables, which is copied inside the graph and so only takes a moment,
+    and then the snapshot is written to disk by a background thread while the training carries on. The snapshot is saved
+    under the names of the original variables, so the checkpoints can be loaded by Model.load_from_save like any other
+    save. Saves are made every save_interval seconds or every save_steps training steps, and only the last few are kept.
+    """
+    save_interval = 10 * 60  # in seconds, None or 0 to only save by steps
+    save_steps = None  # in training steps, None or 0 to only save by time
+    keep_last = 5
+
+    def __init__(self, model):
+        self.model = model
+
+        variables = tf.global_variables()
+        with tf.name_scope("checkpoint"):
+            self.snapshot_variables = [
+                tf.Variable(tf.zeros(variable.get_shape(), variable.dtype.base_dtype), False,
+                            collections=[tf.GraphKeys.LOCAL_VARIABLES], name=variable.op.name.replace("/", "_"))
+                for variable in variables]
+            # these are local so that they aren't saved themselves and so aren't expected by any other saver
+            self.take_snapshot = tf.group(*[snapshot.assign(variable) for snapshot, variable
+                                            in zip(self.snapshot_variables, variables)])
+
+        self.saver = tf.train.Saver({variable.op.name: snapshot for snapshot, variable
+                                     in zip(self.snapshot_variables, variables)},
+                                    max_to_keep=CheckpointManager.keep_last)
+
+        self.thread = None
+        self.last_save_time = time.time()
+        self.last_save_step = 0
+
+    def resume(self, step):
+        """Carries on from the saves of an earlier training, which count towards the ones that are kept"""
+        self.last_save_step = step
+        state = tf.train.get_checkpoint_state(os.path.dirname(Model.save_path))
+        if state is not None:
+            self.saver.recover_last_checkpoints(list(state.all_model_checkpoint_paths))
+
+    def step(self, session, step):
+        """Called after every training step, saves the training if a save is due"""
+        due = (CheckpointManager.save_interval and
+               time.time() - self.last_save_time >= CheckpointManager.save_interval) or \
+              (CheckpointManager.save_steps and step - self.last_save_step >= CheckpointManager.save_steps)
+
+        if due and (self.thread is None or not self.thread.is_alive()):
+            # if the last save is still being written then this one waits until the next step
+            self.save(session, step)
+
+    def save(self, session, step):
+        """Takes a snapshot of the variables and writes it in the background"""
+        session.run(self.take_snapshot)
+        self.last_save_time = time.time()
+        self.last_save_step = step
+
+        self.thread = threading.Thread(target=self.write, args=(session, step), name="Checkpoint", daemon=True)
+        self.thread.start()
+
+    def write(self, session, step):
+        """This is what the background thread runs"""
+        print("Saving to " + Model.save_path + "-" + str(step))
+        save_path = self.saver.save(session, Model.save_path, step, write_meta_graph=False)
+        self.model.statistics.save(save_path + Model.statistics_suffix)
+        # the statistics are saved with every save, so that a save is never loaded with another training's statistics
+
+        folder, name = os.path.split(Model.save_path)
+        kept = set(self.saver.last_checkpoints)
+        for file_name in os.listdir(folder):
+            if file_name.startswith(name + "-") and file_name.endswith(Model.statistics_suffix) and \
+                    os.path.join(folder, file_name[:-len(Model.statistics_suffix)]) not in kept:
+                os.remove(os.path.join(folder, file_name))
+        # the saver deletes the saves that are no longer kept, but not their statistics
+
+    def close(self, session, step):
+        """Makes a final save and waits for all the saves to be written"""
+        self.wait()
+        self.save(session, step)
+        self.wait()
+
+    def wait(self):
+        """Waits until the save that is being written has finished"""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class TrainingMetrics:
+    """
+    This class records the progress of the training, which is printed and logged to a csv file
+
+    So that recording the progress takes as little time away from the training as possible, only every
+    print_interval-th step is printed and the log is written by a background thread, which writes the lines in chunks.
+    Along with the cost, the throughput of the training is printed, that is the examples trained on per second, the
+    average time of a training step, how long the input pipeline had to wait for batches from the data source and how
+    many batches it has read from it so far, as each batch is trained on for several iterations.
+    """
+    print_interval = 10  # in steps
+    flush_interval = 5  # in seconds
+
+    log_form = "{0}, {1}, {2}, {3}\n"
+    throughput_form = " Examples/s: {0:0.2f} Step: {1:0.3f}s Batch wait: {2:0.3f}s Batches read: {3}"
+
+    def __init__(self, model, epochs, iterations, log_file="", append=False):
+        self.model = model
+        self.console_form = "Epoch: {0:" + str(len(str(epochs))) + "d}/" + str(epochs) + " Iteration: {1:" + str(
+            len(str(iterations))) + "d}/" + str(iterations) + " Cost: {2:0.15f}"
+
+        self.steps = 0
+        self.interval_start = time.time()
+        self.interval_step_time = 0
+        self.interval_batch_wait = model.batch_wait_time
+
+        self.lines = Queue()
+        if len(log_file) != 0:
+            self.log_file = open(log_file, "a" if append else "w")
+            self.thread = threading.Thread(target=self.write_log, name="Metrics", daemon=True)
+            self.thread.start()
+        else:
+            self.log_file = None
+            self.thread = None
+
+    def record(self, epoch, iteration, cost, step_time):
+        """Records a training step"""
+        self.steps += 1
+        self.interval_step_time += step_time
+
+        if self.log_file is not None:
+            self.lines.put((epoch, iteration, cost, time.time()))
+
+        if self.steps % TrainingMetrics.print_interval == 0:
+            elapsed = time.time() - self.interval_start
+            batch_wait = self.model.batch_wait_time - self.interval_batch_wait
+
+            print(self.console_form.format(epoch + 1, iteration + 1, cost) + TrainingMetrics.throughput_form.format(
+                TrainingMetrics.print_interval * self.model.batch_size * self.model.accumulation_steps / elapsed,
+                self.interval_step_time / TrainingMetrics.print_interval,
+                batch_wait,
+                self.model.batches_read))
+
+            self.interval_start = time.time()
+            self.interval_step_time = 0
+            self.interval_batch_wait = self.model.batch_wait_time
+
+    def write_log(self):
+        """This is what the background thread runs, it writes the recorded steps to the log in chunks"""
+        chunk = []
+        last_write = time.time()
+
+        while True:
+            try:
+                line = self.lines.get(timeout=TrainingMetrics.flush_interval)
+            except Empty:
+                line = ()  # nothing new was recorded, but whatever is waiting should still be written
+
+            if line is None:  # the metrics were closed
+                break
+            if len(line) != 0:
+                chunk.append(TrainingMetrics.log_form.format(*line))
+
+            if len(chunk) != 0 and time.time() - last_write >= TrainingMetrics.flush_interval:
+                self.log_file.write("".join(chunk))
+                self.log_file.flush()
+                chunk = []
+                last_write = time.time()
+
+        self.log_file.write("".join(chunk))
+        self.log_file.close()
+
+    def close(self):
+        """Writes everything that is left and closes the log"""
+        if self.thread is not None:
+            self.lines.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+class Evaluator:
+    """
+    This class measures how well the latest save transcribes a fixed validation set, while the training carries on
+
+    The validation set is generated once with its own seed and cached on disk as a ShardedDataset, and then kept in
+    memory. It is loaded by run_training before the generator processes and the session are started, since generating
+    it starts processes of its own, which shouldn't be forked from a process that is running TensorFlow. A background
+    thread with its own graph and session checks for new saves from the CheckpointManager and evaluates each of them,
+    so the training loop never waits for it, and the session is limited to one thread so that it takes as little of
+    the processor away from the training as it can. The frame and onset precision, recall and F1 are printed and
+    logged to a csv file.
+    """
+    interval = 60  # the seconds between each check for a new save
+    seed = 987654321
+    batches = 20
+    onset_tolerance = 2  # in frames, how far away a predicted onset can be from the real one
+
+    log_form = "{0}, {1}, {2:.4f}, {3:.4f}, {4:.4f}, {5:.4f}, {6:.4f}, {7:.4f}\n"
+    score_names = ["frame_precision", "frame_recall", "frame_f1", "onset_precision", "onset_recall", "onset_f1"]
+
+    def __init__(self, validation_set, statistics, log_file="validation.csv", append=False):
+        self.data_in, self.labels = validation_set  # as loaded by Evaluator.validation_set
+        self.last_save = None
+
+        self.log_file = open(log_file, "a" if append else "w")
+        if not append:
+            self.log_file.write("time, save, " + ", ".join(Evaluator.score_names) + "\n")
+
+        self.stop_event = threading.Event()
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.model = Model(False, is_transcription_version=True, statistics=statistics)
+        # the model is only used for the saves of the training, so it has the statistics of the training
+        self.session = tf.Session(graph=self.graph, config=tf.ConfigProto(intra_op_parallelism_threads=1,
+                                                                          inter_op_parallelism_threads=1))
+
+        self.thread = threading.Thread(target=self.run, name="Evaluator", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def validation_set(directory):
+        """Loads the validation set into memory, generating it first if it isn't already cached in the directory"""
+        if not os.path.exists(os.path.join(directory, ShardedDataset.manifest_name)):
+            print("Generating the validation set")
+            ShardedDataset.precompute(directory, Evaluator.batches, Evaluator.seed)
+
+        dataset = ShardedDataset(directory, shuffle=False, any_batch_size=True)
+        # the batches are all joined together, so their size doesn't matter
+        if dataset.manifest["example_length"] != Trainer.example_length:
+            raise ValueError("The validation set in " + directory + " has examples of a different length")
+
+        batches = [dataset.get_batch() for _ in range(len(dataset))]
+        return (np.concatenate([data_in for data_in, _ in batches]).astype(np.float32),
+                np.concatenate([data_out for _, data_out in batches]))
+
+    def run(self):
+        """This is what the background thread runs, it evaluates every new save until the evaluator is closed"""
+        while not self.stop_event.wait(Evaluator.interval):
+            self.evaluate_latest()
+
+    def evaluate_latest(self):
+        """Evaluates the latest save, if it hasn't been already"""
+        save_path = Model.latest_save()
+        if save_path == self.last_save or not tf.train.checkpoint_exists(save_path):
+            return
+        self.last_save = save_path
+        if not Model.load_statistics(save_path).matches(self.model.statistics):
+            print("Not validating " + save_path + " since it was trained with other feature statistics")
+            return
+
+        with self.graph.as_default():
+            self.model.get_saver().restore(self.session, save_path)
+
+        predictions = np.concatenate([
+            self.session.run(self.model.predictions,
+                             {self.model.inputs: self.data_in[start:start + Transcriber.windows_per_run]})
+            for start in range(0, len(self.data_in), Transcriber.windows_per_run)])
+        scores = Evaluator.scores(predictions, self.labels[:, 4:-4])
+        # the convolutions use up 4 frames at each end
+
+        print("Validation of " + save_path + ": " + ", ".join(
+            name + " " + str(round(scores[name], 4)) for name in Evaluator.score_names))
+        self.log_file.write(Evaluator.log_form.format(time.time(), save_path,
+                                                      *[scores[name] for name in Evaluator.score_names]))
+        self.log_file.flush()
+
+    @staticmethod
+    def scores(predictions, labels):
+        """
+        The frame and onset precision, recall and F1 of predictions against labels, which are both of shape
+        [examples, frames, pitches]. An onset counts as correct when there is one in the other within
+        onset_tolerance frames of it.
+        """
+        predicted = predictions > Transcriber.threshold
+        actual = labels.astype(bool)
+        scores = Evaluator.summary("frame", np.count_nonzero(predicted & actual), np.count_nonzero(predicted),
+                                   np.count_nonzero(actual))
+
+        predicted_onsets = Evaluator.onsets(predicted)
+        actual_onsets = Evaluator.onsets(actual)
+        found = np.count_nonzero(predicted_onsets & Evaluator.widen(actual_onsets))
+        recalled = np.count_nonzero(actual_onsets & Evaluator.widen(predicted_onsets))
+        scores.update(Evaluator.summary("onset", found, np.count_nonzero(predicted_onsets),
+                                        np.count_nonzero(actual_onsets), recalled))
+        return scores
+
+    @staticmethod
+    def summary(name, true_positives, predicted, actual, recalled=None):
+        """The precision, recall and F1 from the counts, where recalled is the true positives of the recall"""
+        recalled = true_positives if recalled is None else recalled
+        precision = true_positives / max(predicted, 1)
+        recall = recalled / max(actual, 1)
+        f1 = 0 if precision + recall == 0 else 2 * precision * recall / (precision + recall)
+        return {name + "_precision": precision, name + "_recall": recall, name + "_f1": f1}
+
+    @staticmethod
+    def onsets(active):
+        """The frames where each pitch starts being active, from an array of shape [examples, frames, pitches]"""
+        onsets = active.copy()
+        onsets[:, 1:] &= ~active[:, :-1]
+        return onsets
+
+    @staticmethod
+    def widen(onsets):
+        """Spreads each onset over the frames within onset_tolerance of it"""
+        widened = onsets.copy()
+        for shift in range(1, Evaluator.onset_tolerance + 1):
+            widened[:, shift:] |= onsets[:, :-shift]
+            widened[:, :-shift] |= onsets[:, shift:]
+        return widened
+
+    def close(self):
+        """Stops the background thread, and then evaluates the last save if it hasn't been already"""
+        self.stop_event.set()
+        self.thread.join()
+        self.evaluate_latest()
+        self.session.close()
+        self.log_file.close()
+
 
 class Model:
     """This is the object for the machine learning model itself"""
@@ -612,30 +1891,65 @@ class Model:
 
     export_path = "models/model"
     save_path = "saves/tf_save"
-
-    f_bank = generate_mel_transform(start_mel_frequency, end_mel_frequency, mel_filters, frame_length)
-
-    def __init__(self, is_export_version):
+    statistics_suffix = ".statistics.npz"  # each save has the statistics that it was trained with next to it
+    statistics_path = save_path + "_statistics.npz"  # where the statistics were kept before they were kept per save
+
+    prefetch_batches = 2  # the amount of batches that the input pipeline reads ahead
+
+    queue_operations = ["enqueue_start_inputs", "enqueue_new_inputs", "deque_inputs"]
+    saved_model_outputs = ["predictions", "mel_bins", "de_phased_reconstruction", "de_phased_rms"]
+    # what the Kotlin application currently fetches from the SavedModel
+    frozen_outputs = ["predictions", "mel_bins"]
+    quantized_weights = re.compile(r"^(conv2d(_\d+)?/kernel|output_w1(_\d+)?)(/|$)")
+    # the weights that are stored in eight bits, by the names of their variables, which are still the start of the
+    # names of their constants after they have been folded. The window and the mel filter bank are left in float
+    quantize_transforms = ["quantize_nodes(ignore_op=Mul)", "strip_unused_nodes", "sort_by_execution_order"]
+    # the window, the mel filter bank and the normalisation are multiplications, so those are left in float too
+
+    mel_bank = MelFilterBank(start_mel_frequency, end_mel_frequency, mel_filters, frame_length)
+    f_bank = mel_bank.dense()
+
+    def __init__(self, is_export_version, data_source=None, batch_size=None, is_transcription_version=False,
+                 statistics=None):
         # the export version has more organisation to aid the use of the exported model
+        # the data source is what the training batches are read from, anything that has a get_batch method
+        # the transcription version takes any amount of whole examples of log mel frames at once
+        # the statistics normalise the inputs, by default they are the ones that the last save was trained with
 
         self.is_export_version = is_export_version
+        self.is_transcription_version = is_transcription_version
+        self.is_training = not (is_export_version or is_transcription_version)
+        self.data_source = data_source
+        self.statistics = Model.load_statistics() if statistics is None else statistics
 
         self.y = None
         self.cost = None
         self.train_step = None
-        self.in_data_x = None
-        self.in_data_y = None
-        self.init_data_x = None
-        self.init_data_y = None
+        self.iterator = None
+        self.saver = None
+        self.inputs = None
+        self.predictions = None
+        self.accumulate_step = None
+
+        self.conv_layers = None
+        self.dense_variables = None
+        self.towers = Trainer.towers
+        self.accumulation_steps = Trainer.accumulation_steps
+
+        self.batch_size = 1 if is_export_version else Trainer.batch_size if batch_size is None else batch_size
+        if self.is_training and self.batch_size % self.towers != 0:
+            raise ValueError("The batch size of {} can't be split between {} towers".format(self.batch_size,
+                                                                                         self.towers))
+        self.batch_wait_time = 0  # the total time that the input pipeline has waited for the data source
+        self.batches_read = 0  # the batches that the input pipeline has read from the data source
 
         self.define()
 
     def define(self):
         """This creates the machine learning model in TensorFlow"""
 
-        batch_size = 1 if self.is_export_version else Trainer.batch_size
-        example_length = 9 if self.is_export_version else int(
-            np.ceil(float(np.abs(Trainer.example_length - Model.frame_length)) / Model.frame_step))
+        batch_size = self.batch_size
+        example_length = 9 if self.is_export_version else Model.frames_for(Trainer.example_length)
 
         if self.is_export_version:
             # all of this processes the signal that is input
@@ -648,9 +1962,6 @@ class Model:
 
             x = x * hamming_window(Model.frame_length)
 
-            tf_f_bank = tf.constant(Model.f_bank, tf.float32, shape=[Model.frame_length // 2 + 1, Model.mel_filters],
-                                    verify_shape=True)
-
             fft = tf.spectral.rfft(x)
             de_phased = tf.spectral.irfft(tf.complex(tf.sqrt(tf.real(fft) ** 2 + tf.imag(fft) ** 2), 0.0),
                                           name="de_phased_reconstruction")
@@ -660,7 +1971,7 @@ class Model:
 
             tf_pow_frames = (tf.pow(fft_reshape, 2)) / Model.frame_length  # Power Spectrum
 
-            tf_filter_banks = tf.matmul(tf_pow_frames, tf_f_bank)
+            tf_filter_banks = Model.mel_bank.project_tf(tf_pow_frames)
             tf_filter_banks = tf.maximum(tf_filter_banks, 1e-10)
             tf_filter_banks = tf.log(tf_filter_banks, "mel_bins")
 
@@ -677,23 +1988,74 @@ class Model:
             input_queue.enqueue(x[1:example_length], "enqueue_new_inputs")
             x = tf.reshape(x, [1, example_length, Model.mel_filters, 1])
 
+        elif self.is_transcription_version:
+
+            x = tf.placeholder(tf.float32, [None, example_length, Model.mel_filters, 1], "transcription_inputs")
+            self.inputs = x
+
         else:
 
-            data_x = tf.Variable(tf.zeros((batch_size, example_length, Model.mel_filters, 1), tf.float32), False,
-                                 collections=[tf.GraphKeys.LOCAL_VARIABLES])
-            data_y = tf.Variable(
-                tf.zeros((batch_size, example_length, Model.end_pitch - Model.start_pitch, 2), tf.float32),
-                False,
-                collections=[tf.GraphKeys.LOCAL_VARIABLES])
-            self.in_data_x = tf.placeholder(tf.float32, data_x.get_shape())
-            self.in_data_y = tf.placeholder(tf.float32, data_y.get_shape())
-            self.init_data_x = data_x.assign(self.in_data_x, True)
-            self.init_data_y = data_y.assign(self.in_data_y, True)
+            x, labels = self.input_pipeline(batch_size)
+            x = tf.cast(x, tf.float32)
+            y_hat = tf.one_hot(tf.cast(labels, tf.int32), 2, dtype=tf.float32, name="targets")
+            # the compact labels are expanded into the off and on pairs here, rather than being sent around as them
 
-            x = data_x
-            y_hat = tf.identity(data_y, "targets")
+        if not self.is_training:
+            self.y = self.network(x)
 
-        x_normal = (x - DataGenerator.data_mean) / DataGenerator.data_var
+        if self.is_export_version:
+            predictions = tf.identity(self.y[:, :, :, 1], name="predictions")
+        elif self.is_transcription_version:
+            self.predictions = self.y[:, :, :, 1]
+        else:
+            optimizer = tf.train.AdamOptimizer(Trainer.learning_rate)
+
+            # the batch is split between the towers, which share their variables and are run in parallel
+            tower_y = []
+            tower_costs = []
+            tower_gradients = []
+            for x_tower, y_hat_tower in zip(tf.split(x, self.towers), tf.split(y_hat, self.towers)):
+                y = self.network(x_tower)
+                y_hat_tower = y_hat_tower[:, 4:-4, :, :]
+                cost = -tf.reduce_mean(
+                    tf.reduce_sum(
+                        y_hat_tower * tf.log(tf.clip_by_value(y, 1e-10, 1.0)),
+                        axis=[1]))  # cross entropy
+
+                tower_y.append(y)
+                tower_costs.append(cost)
+                tower_gradients.append(optimizer.compute_gradients(cost))
+
+            self.y = tower_y[0] if self.towers == 1 else tf.concat(tower_y, 0)
+            self.cost = tf.add_n(tower_costs) / self.towers
+            gradients = [(tf.add_n([tower[index][0] for tower in tower_gradients]) / self.towers, variable)
+                         for index, (_, variable) in enumerate(tower_gradients[0])]
+
+            if self.accumulation_steps == 1:
+                self.train_step = optimizer.apply_gradients(gradients)
+            else:
+                # the gradients of several micro-batches are added up before the weights are updated, which makes the
+                # effective batch size larger without using any more memory in each step
+                accumulators = [tf.Variable(tf.zeros(variable.get_shape(), variable.dtype.base_dtype), False,
+                                            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                                for _, variable in gradients]
+                self.accumulate_step = tf.group(*[accumulator.assign_add(gradient / self.accumulation_steps)
+                                                  for accumulator, (gradient, _) in zip(accumulators, gradients)])
+                apply_step = optimizer.apply_gradients(
+                    [(accumulator, variable) for accumulator, (_, variable) in zip(accumulators, gradients)])
+                with tf.control_dependencies([apply_step]):
+                    self.train_step = tf.group(*[accumulator.assign(tf.zeros_like(accumulator))
+                                                 for accumulator in accumulators])
+
+    def network(self, x):
+        """
+        Creates the layers of the model on top of the input. The variables are created the first time that this is
+        called, and any later calls(the other towers) share them. The length of the examples doesn't have to be
+        known, in which case it is found when the graph is run.
+        """
+        x_normal = (x - self.statistics.mean[:, np.newaxis].astype(np.float32)) / \
+            self.statistics.std[:, np.newaxis].astype(np.float32)
+        # each mel bin is normalised on its own
 
         layers = [
             ("valid", 3, 7, 48, 1, 2),
@@ -705,55 +2067,100 @@ class Model:
 
         last_layer = x_normal
 
-        for padding, kernel_width, kernel_height, filters, pool_size, strides in layers:  # stacks convolution layers
-
-            conv = tf.layers.conv2d(
-                inputs=last_layer,
+        if self.conv_layers is None:
+            self.conv_layers = [tf.layers.Conv2D(
                 filters=filters,
                 kernel_size=[kernel_width, kernel_height],
                 padding=padding,
-                activation=tf.nn.relu)
+                activation=tf.nn.relu) for padding, kernel_width, kernel_height, filters, _, _ in layers]
+
+        for conv_layer, (_, _, _, _, pool_size, strides) in zip(self.conv_layers, layers):  # stacks convolution layers
+
+            conv = conv_layer(last_layer)
 
             conv = tf.layers.max_pooling2d(inputs=conv, pool_size=[1, pool_size], strides=[1, strides])
-            if not self.is_export_version:
+            if self.is_training:
                 conv = tf.nn.dropout(conv, Trainer.keep_prob)
             last_layer = self.normalise(conv)
 
-        conv_out = tf.reshape(last_layer, [batch_size, example_length - 8, -1])
+        conv_features = last_layer.get_shape()[2].value * last_layer.get_shape()[3].value
+        output_length = last_layer.get_shape()[1].value  # the convolutions take 8 frames off the length
+        if output_length is None:
+            output_length = tf.shape(last_layer)[1]
+        conv_out = tf.reshape(last_layer, [-1, output_length, conv_features])
 
         dense_size = 192
 
         # two dense layers and then an activation
 
-        output_w1 = tf.Variable(
-            tf.random_normal([conv_out.get_shape()[-1].value, dense_size]),
-            name="output_w1")
-        output_b1 = tf.Variable(tf.zeros(dense_size), name="output_b1")
+        if self.dense_variables is None:
+            self.dense_variables = (
+                tf.Variable(
+                    tf.random_normal([conv_features, dense_size]),
+                    name="output_w1"),
+                tf.Variable(tf.zeros(dense_size), name="output_b1"),
+                tf.Variable(
+                    tf.random_normal([dense_size, 2 * (Model.end_pitch - Model.start_pitch)]),
+                    name="output_w1"),
+                tf.Variable(tf.zeros([2 * (Model.end_pitch - Model.start_pitch)]), name="output_b1"))
+        output_w1, output_b1, output_w2, output_b2 = self.dense_variables
 
         dense_1 = tf.nn.relu(
-            tf.matmul(tf.reshape(conv_out, [-1, conv_out.get_shape()[-1].value]), output_w1) + output_b1)
-        if not self.is_export_version:
+            tf.matmul(tf.reshape(conv_out, [-1, conv_features]), output_w1) + output_b1)
+        if self.is_training:
             dense_1 = tf.nn.dropout(dense_1, Trainer.keep_prob)
         dense_1 = self.normalise(dense_1)
 
-        output_w2 = tf.Variable(
-            tf.random_normal([dense_size, 2 * (Model.end_pitch - Model.start_pitch)]),
-            name="output_w1")
-        output_b2 = tf.Variable(tf.zeros([2 * (Model.end_pitch - Model.start_pitch)]), name="output_b1")
-
-        self.y = tf.reshape(tf.nn.softmax(tf.reshape(tf.matmul(dense_1, output_w2) + output_b2, [-1, 2])),
-                            [batch_size, example_length - 8, Model.end_pitch - Model.start_pitch, 2], "y")
+        return tf.reshape(tf.nn.softmax(tf.reshape(tf.matmul(dense_1, output_w2) + output_b2, [-1, 2])),
+                          [-1, output_length, Model.end_pitch - Model.start_pitch, 2], "y")
 
-        if self.is_export_version:
-            predictions = tf.identity(self.y[:, :, :, 1], name="predictions")
-        else:
-            y_hat = y_hat[:, 4:-4, :, :]
-            self.cost = -tf.reduce_mean(
-                tf.reduce_sum(
-                    y_hat * tf.log(tf.clip_by_value(self.y, 1e-10, 1.0)),
-                    axis=[1]))  # cross entropy
+    def input_pipeline(self, batch_size):
+        """
+        Creates the pipeline that reads the batches from the data source. Each batch is repeated for all of the
+        iterations that are trained on it, and the next batches are read in the background while the current one is
+        being trained on, so the training never waits for a batch to be copied into the graph. The length of the
+        examples is left open, so that the same graph can train on batches of any length.
+        """
+        shapes = (tf.TensorShape([batch_size, None, Model.mel_filters, 1]),
+                  tf.TensorShape([batch_size, None, Model.end_pitch - Model.start_pitch]))
+        if self.accumulation_steps > 1:
+            shapes = tuple(tf.TensorShape([self.accumulation_steps]).concatenate(shape) for shape in shapes)
+
+        dataset = tf.data.Dataset.from_generator(self.read_batches, (tf.as_dtype(self.data_source.feature_dtype),
+                                                                     tf.uint8), shapes)
+        dataset = dataset.prefetch(Model.prefetch_batches)
+        dataset = dataset.flat_map(lambda x, y: tf.data.Dataset.from_tensors((x, y)).repeat(Trainer.iterations))
+        if self.accumulation_steps > 1:
+            # the batches that are accumulated into each update are read together and repeated in the same order
+            dataset = dataset.flat_map(lambda x, y: tf.data.Dataset.from_tensor_slices((x, y)))
+
+        self.iterator = dataset.make_one_shot_iterator()
+        return self.iterator.get_next()
+
+    def read_batches(self):
+        """
+        Reads batches from the data source forever, while keeping track of how long it has to wait for them. When
+        gradients are accumulated, the batches of each update are stacked together.
+        """
+        while True:
+            start_time = time.time()
+            if self.accumulation_steps == 1:
+                batch = self.data_source.get_batch()
+            else:
+                batch = Model.stack_batches([self.data_source.get_batch() for _ in range(self.accumulation_steps)])
+            self.batch_wait_time += time.time() - start_time
+            self.batches_read += self.accumulation_steps
+            yield batch
 
-            self.train_step = tf.train.AdamOptimizer(Trainer.learning_rate).minimize(self.cost)
+    @staticmethod
+    def stack_batches(batches):
+        """
+        Stacks batches into one array of inputs and one of labels. The example length can change between batches,
+        so they are all cut down to the shortest one.
+        """
+        length = min(data_in.shape[1] for data_in, _ in batches)
+        return (np.stack([data_in[:, :length] for data_in, _ in batches]),
+                np.stack([data_out[:, :length] for _, data_out in batches]))
 
     @staticmethod
     def normalise(tensor):
@@ -764,59 +2171,954 @@ class Model:
     def init(self, session):
         """Inits the TensorFlow session"""
         session.run(tf.global_variables_initializer())
+        session.run(tf.local_variables_initializer())
 
-    def load_from_save(self, session):
-        """Loads the state of the TensorFlow session from file"""
-        print("Loading save from " + Model.save_path)
+    @staticmethod
+    def load_statistics(save_path=None):
+        """The statistics that a save, by default the latest one, was trained with"""
+        save_path = Model.latest_save() if save_path is None else save_path
+        if os.path.exists(save_path + Model.statistics_suffix):
+            return FeatureStatistics.load(save_path + Model.statistics_suffix)
+        if os.path.exists(Model.statistics_path):
+            print("There are no statistics for " + save_path + " so the ones from " + Model.statistics_path +
+                  " are used")
+            return FeatureStatistics.load(Model.statistics_path)
+        return FeatureStatistics.constant()
+
+    def run_train_step(self, session):
+        """
+        Makes one update of the weights and returns its cost. When gradients are accumulated, this reads one batch for
+        each accumulation step and the cost is the average over them.
+        """
+        if self.accumulation_steps == 1:
+            _, current_cost = session.run([self.train_step, self.cost])
+            return current_cost
 
-        saver = tf.train.Saver()
-        saver.restore(session, Model.save_path)
-        del saver
+        costs = [session.run([self.accumulate_step, self.cost])[1] for _ in range(self.accumulation_steps)]
+        session.run(self.train_step)
+        return sum(costs) / len(costs)
 
-    def save(self, session):
-        """Save sthe state of the TensorFlow session from file"""
-        print("Saving to " + Model.save_path)
+    def get_saver(self):
+        """The saver is only created once, since every new saver adds more operations to the graph"""
+        if self.saver is None:
+            self.saver = tf.train.Saver()
+        return self.saver
 
-        saver = tf.train.Saver()
-        saver.save(session, Model.save_path)
-        del saver
+    @staticmethod
+    def frames_for(example_length):
+        """The amount of frames that the spectrum of an example of this many samples has"""
+        return int(np.ceil(float(np.abs(example_length - Model.frame_length)) / Model.frame_step))
 
-    def export(self, session, name):
-        """Exports state to file that can then be read in Kotlin"""
-        print("Exporting model to " + Model.export_path + " as " + name)
+    @staticmethod
+    def latest_save():
+        """Finds the latest save, which is either the newest of the CheckpointManager's or the one at save_path"""
+        latest = tf.train.latest_checkpoint(os.path.dirname(Model.save_path))
+        return Model.save_path if latest is None else latest
 
-        builder = tf.saved_model.builder.SavedModelBuilder(Model.export_path + name)
+    @staticmethod
+    def save_step(save_path):
+        """The training step that a save was made at, which the CheckpointManager adds to its name"""
+        match = re.search(r"-(\d+)$", save_path)
+        return 0 if match is None else int(match.group(1))
+
+    def load_from_save(self, session):
+        """Loads the state of the TensorFlow session from file"""
+        save_path = Model.latest_save()
+        print("Loading save from " + save_path)
+
+        self.get_saver().restore(session, save_path)
+
+    def export(self, session, name, directory=None):
+        """
+        Exports state to file that can then be read in Kotlin. It is exported to the export path with the name added
+        to the end, unless another directory is given, which mustn't exist yet.
+        """
+        directory = Model.export_path + name if directory is None else directory
+        print("Exporting model to " + directory)
+
+        builder = tf.saved_model.builder.SavedModelBuilder(directory)
         builder.add_meta_graph_and_variables(session, [tf.saved_model.tag_constants.SERVING])
         builder.save(True)
         del builder
+        return directory
+
+    def export_frozen(self, session, name, outputs=None):
+        """
+        Exports a frozen graph, where the variables are folded into constants and only the parts of the graph that the
+        outputs need are kept, e.g. the de-phased reconstruction is left out unless it is asked for. The operations of
+        the input queue are always kept, since the model can't be run without them.
+        """
+        outputs = Model.frozen_outputs if outputs is None else outputs
+        outputs = list(outputs) + [name for name in Model.queue_operations if name not in outputs]
+        file_path = Model.export_path + name + ".pb"
+        print("Exporting frozen model with the outputs " + ", ".join(outputs) + " to " + file_path)
+
+        graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(), outputs)
+        # this also strips everything that the outputs don't depend on
+
+        try:
+            from tensorflow.tools.graph_transforms import TransformGraph
+            graph_def = TransformGraph(Model.fold_constants(graph_def, outputs), ["inputs"], outputs,
+                                       ["sort_by_execution_order"])
+        except ImportError:
+            print("The graph transforms aren't available in this version of TensorFlow, so constants aren't folded")
+
+        with tf.gfile.GFile(file_path, "wb") as file:
+            file.write(graph_def.SerializeToString())
+
+        return file_path
+
+    def export_quantized(self, session, name, calibration_frames, outputs=None):
+        """
+        Exports a frozen graph where the convolutions and dense layers run in eight bits, and their weights are
+        stored in eight bits. Each quantized layer's outputs are requantized to a range, which is calibrated by
+        running frames of audio through the graph and then fixed as constants, so that it isn't searched for on
+        every frame. The spectrum and mel filter bank before the layers stay in float. The types of the operations in
+        the exported graph are printed, so that what was quantized can be checked.
+        """
+        from tensorflow.tools.graph_transforms import TransformGraph
+        # unlike for the frozen export, there's nothing to fall back on without the graph transforms
+
+        outputs = Model.frozen_outputs if outputs is None else outputs
+        outputs = list(outputs) + [name for name in Model.queue_operations if name not in outputs]
+        file_path = Model.export_path + name + "_int8.pb"
+        print("Exporting eight bit model with the outputs " + ", ".join(outputs) + " to " + file_path)
+
+        graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(), outputs)
+        graph_def = Model.fold_constants(graph_def, outputs)
+        graph_def = TransformGraph(Model.quantize_weights(graph_def), ["inputs"], outputs, Model.quantize_transforms)
+
+        ranges = Model.calibrate_ranges(graph_def, calibration_frames)
+        graph_def = TransformGraph(Model.fix_ranges(graph_def, ranges), ["inputs"], outputs,
+                                   ["strip_unused_nodes", "sort_by_execution_order"])
+        # the RequantizationRange operations aren't used anymore
+
+        with tf.gfile.GFile(file_path, "wb") as file:
+            file.write(graph_def.SerializeToString())
+
+        operation_types = {}
+        for node in graph_def.node:
+            operation_types[node.op] = operation_types.get(node.op, 0) + 1
+        print("The operations of the eight bit model are " + ", ".join(
+            str(count) + " " + op for op, count in sorted(operation_types.items())))
+
+        return file_path
+
+    @staticmethod
+    def fold_constants(graph_def, outputs):
+        """
+        Folds the parts of a frozen export graph that don't depend on its inputs into constants, e.g. the window. The
+        fold_constants transform runs the graph up to its outputs, which it can't do with the queue operations, so it
+        is only given the outputs that are tensors, and the parts of the graph that only the queue operations use are
+        copied back afterwards.
+        """
+        from tensorflow.tools.graph_transforms import TransformGraph
+
+        folded = TransformGraph(graph_def, ["inputs"], [name for name in outputs if name not in Model.queue_operations],
+                                ["add_default_attributes", "remove_attribute(attribute_name=_class)", "fold_constants"])
+        # the colocation attributes would point at nodes that have been folded away
+
+        names = set(node.name for node in folded.node)
+        queue_operations = [name for name in outputs if name in Model.queue_operations]
+        for node in tf.graph_util.extract_sub_graph(graph_def, queue_operations).node:
+            if node.name not in names:
+                copy = folded.node.add()
+                copy.CopyFrom(node)
+                if "_class" in copy.attr:
+                    del copy.attr["_class"]
+
+        return tf.graph_util.extract_sub_graph(folded, outputs)
+        # the folding leaves the nodes that it folded away behind, e.g. the ones that computed the window
+
+    @staticmethod
+    def quantize_weights(graph_def):
+        """
+        Replaces the float constants of the weights in Model.quantized_weights with eight bit constants, which are
+        turned back into float by a Dequantize operation of the same name. This is what the quantize_weights graph
+        transform does, but that picks the constants by how many values they have rather than what they are.
+        """
+        quantized = tf.GraphDef()
+        for node in graph_def.node:
+            if node.op != "Const" or node.attr["dtype"].type != tf.float32.as_datatype_enum or \
+                    Model.quantized_weights.match(node.name) is None:
+                quantized.node.add().CopyFrom(node)
+                continue
+
+            print("Storing " + node.name + " in eight bits")
+            range_min, range_max, values = Model.quantize_values(tf.make_ndarray(node.attr["value"].tensor))
+
+            constant = quantized.node.add()
+            constant.op = "Const"
+            constant.name = node.name + "_quantized_const"
+            constant.attr["dtype"].type = tf.quint8.as_datatype_enum
+            constant.attr["value"].tensor.dtype = tf.quint8.as_datatype_enum
+            constant.attr["value"].tensor.tensor_shape.CopyFrom(tf.TensorShape(values.shape).as_proto())
+            constant.attr["value"].tensor.tensor_content = values.tobytes()
+
+            for suffix, value in (("_quantized_min", range_min), ("_quantized_max", range_max)):
+                limit = quantized.node.add()
+                limit.op = "Const"
+                limit.name = node.name + suffix
+                limit.attr["dtype"].type = tf.float32.as_datatype_enum
+                limit.attr["value"].tensor.CopyFrom(tf.make_tensor_proto(value, tf.float32))
+
+            dequantize = quantized.node.add()
+            dequantize.op = "Dequantize"
+            dequantize.name = node.name
+            dequantize.input.extend([constant.name, node.name + "_quantized_min", node.name + "_quantized_max"])
+            dequantize.attr["T"].type = tf.quint8.as_datatype_enum
+            dequantize.attr["mode"].s = b"MIN_FIRST"
+
+        return quantized
+
+    @staticmethod
+    def quantize_values(values):
+        """
+        Rounds float values to eight bits the way that the MIN_FIRST mode of Dequantize expects, and returns the range
+        that they were rounded in along with them
+        """
+        range_min = float(np.min(values))
+        range_max = max(float(np.max(values)), range_min + 1e-6)
+        scale = 255 / (range_max - range_min)
+        quantized = np.round(values.astype(np.float64) * scale) - np.round(range_min * scale)
+        return range_min, range_max, np.clip(quantized, 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def calibrate_ranges(graph_def, frames):
+        """
+        Runs the frames through a quantized export graph one at a time, and finds the smallest and largest value that
+        each RequantizationRange operation sees over all of them
+        """
+        with tf.Graph().as_default() as graph:
+            tf.import_graph_def(graph_def, name="")
+            range_operations = [operation for operation in graph.get_operations()
+                                if operation.type == "RequantizationRange"]
+            inputs = graph.get_tensor_by_name("inputs:0")
+            fetches = [[operation.outputs[0], operation.outputs[1]] for operation in range_operations]
+
+            print("Calibrating " + str(len(range_operations)) + " ranges on " + str(len(frames)) + " frames")
+            with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                session.run(graph.get_operation_by_name("enqueue_start_inputs"), {inputs: frames[0]})
+                values = np.array([session.run([fetches, graph.get_operation_by_name("enqueue_new_inputs")],
+                                               {inputs: frame})[0] for frame in frames])
+                # of shape [frames, ranges, 2]
+
+        return {operation.name: (float(np.min(values[:, index, 0])), float(np.max(values[:, index, 1])))
+                for index, operation in enumerate(range_operations)}
+
+    @staticmethod
+    def fix_ranges(graph_def, ranges):
+        """
+        Replaces the outputs of the RequantizationRange operations with constants of their calibrated ranges, including
+        where they are control inputs, which are written as ^name
+        """
+        fixed = tf.GraphDef()
+        replacements = {}
+        for name, limits in ranges.items():
+            for index, value in enumerate(limits):
+                node = fixed.node.add()
+                node.op = "Const"
+                node.name = name + ("/calibrated_min" if index == 0 else "/calibrated_max")
+                node.attr["dtype"].type = tf.float32.as_datatype_enum
+                node.attr["value"].tensor.CopyFrom(tf.make_tensor_proto(value, tf.float32))
+                replacements[name + ":" + str(index)] = node.name
+            replacements[name] = replacements[name + ":0"]
+
+        for node in graph_def.node:
+            if node.name in ranges:
+                continue
+            copy = fixed.node.add()
+            copy.CopyFrom(node)
+            copy.ClearField("input")
+            copy.input.extend(["^" + replacements.get(name[1:], name[1:]) if name.startswith("^") else
+                               replacements.get(name, name) for name in node.input])
+
+        return fixed
+
+
+class Transcriber:
+    """
+    This class transcribes whole recordings at once, instead of frame by frame like the exported model
+
+    The log mel frames of a recording are computed a window at a time with one reused FeatureExtractor, so that only
+    the frames are kept for the whole recording rather than the spectrum of all of it. They are then cut into windows
+    of the same length as the training examples, which are run through the model several at a time. The windows are
+    the same length as the training examples because the model normalises its convolutions over time, so its
+    predictions depend on the length of what it is given. Each window overlaps the last by the 8 frames that the
+    convolutions use up, so that every frame gets a prediction.
+    """
+    windows_per_run = 16
+    threshold = .5  # the confidence above which a pitch counts as being played
+
+    def __init__(self, session=None):
+        self.window_length = Model.frames_for(Trainer.example_length)
+        self.model = Model(False, is_transcription_version=True)
+
+        self.session = tf.Session() if session is None else session
+        self.model.load_from_save(self.session)
+
+    def features(self, signal):
+        """The log mel frames of a whole signal"""
+        num_frames = max(1, Model.frames_for(signal.size))
+        features = np.empty((num_frames, Model.mel_filters), np.float32)
+        chunk_frames = min(self.window_length, num_frames)
+        extractor = FeatureExtractor(chunk_frames)
+        last_chunk = np.empty((1, chunk_frames, Model.mel_filters), np.float32)
+
+        for start in range(0, num_frames, chunk_frames):
+            start_sample = start * Model.frame_step
+            chunk = signal[start_sample:start_sample + extractor.padded_length].astype(np.float32)[np.newaxis]
+            previous_samples = None if start_sample == 0 else np.float32(signal[start_sample - 1])
+            # the frames of a chunk are the same as they would be if the whole signal was converted at once
+
+            if start + chunk_frames <= num_frames:
+                extractor(chunk, features[np.newaxis, start:start + chunk_frames], previous_samples)
+            else:
+                extractor(chunk, last_chunk, previous_samples)
+                features[start:] = last_chunk[0, :num_frames - start]
+
+        return features
+
+    def predict(self, features):
+        """The confidence of each pitch in each of the frames, of shape [frames, pitches]"""
+        frames = features.shape[0]
+        step = self.window_length - 8
+
+        padded = np.pad(features, [(4, 4 + step * int(np.ceil(frames / step)) - frames), (0, 0)], "edge")
+        # the first and last frames are repeated so that the edges get predictions too
+        windows = np.lib.stride_tricks.as_strided(
+            padded, (int(np.ceil(frames / step)), self.window_length, Model.mel_filters),
+            (step * padded.strides[0],) + padded.strides)
+
+        predictions = np.concatenate([
+            self.session.run(self.model.predictions,
+                             {self.model.inputs: windows[start:start + Transcriber.windows_per_run, :, :, np.newaxis]})
+            for start in range(0, windows.shape[0], Transcriber.windows_per_run)])
+
+        return predictions.reshape(-1, Model.end_pitch - Model.start_pitch)[:frames]
+
+    @staticmethod
+    def notes(piano_roll):
+        """Finds the notes in a piano roll, as rows of pitch, start frame and end frame"""
+        active = np.pad(piano_roll > Transcriber.threshold, [(1, 1), (0, 0)], "constant").astype(np.int8)
+        changes = np.diff(active, axis=0)
+        start_frames, start_pitches = np.nonzero(changes.T == 1)[::-1]
+        end_frames, _ = np.nonzero(changes.T == -1)[::-1]
+        # transposing orders the changes by pitch and then by time, so the nth start pairs with the nth end
+
+        return np.stack([start_pitches + Model.start_pitch, start_frames, end_frames], 1)
+
+    def transcribe(self, file_path, output_folder):
+        """Transcribes a wav file and saves its piano roll and notes in the output folder"""
+        start_time = time.time()
+
+        sample_frequency, signal = scipy.io.wavfile.read(file_path)
+        if sample_frequency != DataGenerator.sample_frequency:
+            raise ValueError(file_path + " has a sample frequency of " + str(sample_frequency) + " instead of " +
+                             str(DataGenerator.sample_frequency))
+        if len(signal.shape) > 1:
+            signal = signal[:, 0]  # select only one chanel of sound
+
+        piano_roll = self.predict(self.features(signal))
+        notes = Transcriber.notes(piano_roll)
+
+        name = os.path.join(output_folder, os.path.splitext(os.path.basename(file_path))[0])
+        np.save(name + "_roll.npy", piano_roll)
+        with open(name + "_notes.csv", "w") as file:
+            file.write("pitch, start, end\n")
+            seconds_per_frame = Model.frame_step / DataGenerator.sample_frequency
+            for pitch, start_frame, end_frame in notes:
+                file.write("{0}, {1:.3f}, {2:.3f}\n".format(pitch, start_frame * seconds_per_frame,
+                                                           end_frame * seconds_per_frame))
+
+        duration = signal.size / DataGenerator.sample_frequency
+        print("Transcribed " + file_path + " (" + str(round(duration, 1)) + "s) with " + str(len(notes)) +
+              " notes at " + str(round(duration / (time.time() - start_time), 1)) + "x real time")
+
+
+class FixedBatchSource:
+    """A data source that always returns the same batch, for measuring the model without the generator"""
+
+    def __init__(self, data_in, data_out):
+        self.data_in = data_in
+        self.data_out = data_out
+        self.feature_dtype = data_in.dtype
+        self.statistics = None
+
+    def get_batch(self):
+        return self.data_in, self.data_out
+
+
+class Benchmark:
+    """
+    This class measures the speed of the slowest parts of the training, which are generating the batches, the training
+    steps and running the exported model. Everything is seeded, and the results are saved as JSON along with the commit
+    that was measured, so that the results of different commits can be compared to catch any regressions.
+    """
+    repeats = 5
+    batch_sizes = [1, 6, 12]
+    training_steps = 10
+    export_frame_count = 100
+    calibration_frame_count = 300
+
+    def __init__(self, seed=0, repeats=None, batch_sizes=None):
+        self.seed = seed
+        self.repeats = Benchmark.repeats if repeats is None else repeats
+        self.batch_sizes = Benchmark.batch_sizes if batch_sizes is None else batch_sizes
+
+    def run(self, output_path):
+        """Runs all of the benchmarks and saves the results"""
+        results = {
+            "commit": Benchmark.commit(),
+            "time": time.time(),
+            "seed": self.seed,
+            "repeats": self.repeats
+        }
+
+        for name, benchmark in [("generator", self.generator), ("mel_transform", self.mel_transform),
+                                ("training", self.training), ("export", self.export)]:
+            print("Benchmarking " + name)
+            seed(self.seed)
+            np.random.seed(self.seed)
+            try:
+                results[name] = benchmark()
+            except (OSError, ValueError) as error:
+                # e.g. the sounds aren't available on this machine, which shouldn't stop the other benchmarks
+                results[name] = {"error": str(error)}
+            print(json.dumps(results[name], indent=2))
+
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+        print("Saved the results to " + output_path)
+
+        return results
+
+    @staticmethod
+    def commit():
+        """The commit that is being benchmarked, if it can be found"""
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def measure(self, function, repeats=None):
+        """Times a function over several runs, the first run isn't counted since it can include one off costs"""
+        function()
+
+        times = []
+        for _ in range(self.repeats if repeats is None else repeats):
+            start_time = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start_time)
+
+        return {"mean": float(np.mean(times)), "min": float(np.min(times)), "max": float(np.max(times))}
+
+    def generator(self):
+        """The batches per second of generate_batch, and the time and memory of each of its stages per batch"""
+        data_generator = DataGenerator()
+
+        results = {"generate_batch": self.measure(lambda: data_generator.generate_batch)}
+        results["batches_per_second"] = 1 / results["generate_batch"]["mean"]
+        results["batch_bytes"] = sum(array.nbytes for array in data_generator.generate_batch)
+
+        was_tracing = tracemalloc.is_tracing()
+        profiler = StageProfiler("1")
+        profiled_generator = DataGenerator(profiler)
+        profiled_generator.generate_batch
+        profiler.reset()  # the first batch isn't counted since it can include one off costs
+        for _ in range(self.repeats):
+            profiled_generator.generate_batch
+        if not was_tracing:
+            tracemalloc.stop()  # so that tracing the memory doesn't slow down the other benchmarks
+
+        results["stages"] = {name: {"ms_per_batch": 1000 * seconds / profiler.batches,
+                                    "calls_per_batch": calls / profiler.batches,
+                                    "mb_per_call": allocated / calls / 2 ** 20}
+                             for name, (calls, seconds, allocated) in profiler.totals.items() if name != "batch"}
+        # these are measured by the StageProfiler on the same generate_batch that the training runs, but as it also
+        # traces the memory, they are slower than the batches per second above
+        return results
+
+    def mel_transform(self):
+        """The time it takes to build the mel filter bank, and to project a batch of spectra onto it"""
+        arguments = (Model.start_mel_frequency, Model.end_mel_frequency, Model.mel_filters, Model.frame_length)
+        num_frames = Model.frames_for(Trainer.example_length)
+        pow_frames = np.random.rand(Trainer.batch_size, num_frames, Model.mel_bank.end).astype(np.float32)
+
+        return {
+            "generate_mel_transform": self.measure(lambda: generate_mel_transform(*arguments)),
+            "mel_filter_bank": self.measure(lambda: MelFilterBank(*arguments)),
+            "project_batch": self.measure(lambda: Model.mel_bank.project(pow_frames))
+        }
+
+    def training(self):
+        """The training steps per second of the training model on the CPU, for each of the batch sizes"""
+        num_frames = Model.frames_for(Trainer.example_length)
+        results = {}
+
+        for batch_size in self.batch_sizes:
+            data_in = np.random.normal(DataGenerator.data_mean, DataGenerator.data_var,
+                                       (batch_size, num_frames, Model.mel_filters, 1)).astype(np.float32)
+            data_out = np.random.rand(batch_size, num_frames, Model.end_pitch - Model.start_pitch) < .1
+            data_out = data_out.astype(np.uint8)
+
+            with tf.Graph().as_default():
+                tf.set_random_seed(self.seed)
+                model = Model(False, FixedBatchSource(data_in, data_out), batch_size)
+
+                with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                    model.init(session)
+                    step = self.measure(lambda: model.run_train_step(session),
+                                        self.repeats * Benchmark.training_steps)
+
+            results[str(batch_size)] = {"step": step, "steps_per_second": 1 / step["mean"],
+                                        "examples_per_second": batch_size / step["mean"]}
+
+        return results
+
+    def export(self):
+        """The latency of each frame of the export model, run the same way as it is in the Kotlin application"""
+        with tf.Graph().as_default() as graph:
+            tf.set_random_seed(self.seed)
+            Model(True)
+
+            with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                session.run(tf.global_variables_initializer())
+                _, latency = Benchmark.frame_latency(session, graph, Model.saved_model_outputs,
+                                                     Benchmark.export_frames())
+
+        return latency
+
+    def compare_exports(self, name, output_path, outputs=None):
+        """
+        Exports the last save both as a SavedModel and as a frozen graph with only the given outputs, and compares
+        their sizes, per frame latencies and predictions
+        """
+        outputs = Model.frozen_outputs if outputs is None else outputs
+        frames = Benchmark.export_frames()
+        saved_model_folder = tempfile.mkdtemp(prefix="saved_model_")
+        # the SavedModel can't be exported over an existing one, so it is exported somewhere new every time
+
+        try:
+            with tf.Graph().as_default():
+                model = Model(True)
+                with tf.Session() as session:
+                    model.init(session)
+                    model.load_from_save(session)
+                    saved_model_path = model.export(session, name, os.path.join(saved_model_folder, name))
+                    frozen_path = model.export_frozen(session, name, outputs)
+
+            with tf.Graph().as_default() as graph:
+                with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                    tf.saved_model.loader.load(session, [tf.saved_model.tag_constants.SERVING], saved_model_path)
+                    saved_model_results, saved_model_latency = Benchmark.frame_latency(
+                        session, graph, Model.saved_model_outputs, frames)
+            saved_model_bytes = Benchmark.size_of(saved_model_path)
+        finally:
+            shutil.rmtree(saved_model_folder, ignore_errors=True)
+
+        with tf.Graph().as_default() as graph:
+            graph_def = tf.GraphDef()
+            with tf.gfile.GFile(frozen_path, "rb") as file:
+                graph_def.ParseFromString(file.read())
+            tf.import_graph_def(graph_def, name="")
+            with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                frozen_results, frozen_latency = Benchmark.frame_latency(session, graph, outputs, frames)
+
+        results = {
+            "commit": Benchmark.commit(),
+            "outputs": outputs,
+            "saved_model": {"bytes": saved_model_bytes, "latency": saved_model_latency},
+            "frozen": {"path": frozen_path, "bytes": Benchmark.size_of(frozen_path), "latency": frozen_latency},
+            "max_prediction_difference": float(np.max(np.abs(
+                saved_model_results[Model.saved_model_outputs.index("predictions")] -
+                frozen_results[outputs.index("predictions")]))) if "predictions" in outputs else None
+        }
+
+        print(json.dumps(results, indent=2))
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+        return results
+
+    def compare_quantized(self, name, output_path, calibration_count=None, test_count=None):
+        """
+        Exports the last save both as a float frozen graph and as an eight bit one, calibrated on generated audio,
+        and compares their sizes and per frame latencies. Both are scored against the labels of different generated
+        audio, and the eight bit predictions also against the float ones, as the frame and onset agreement of the
+        pitches that they find.
+        """
+        calibration_count = Benchmark.calibration_frame_count if calibration_count is None else calibration_count
+        test_count = Benchmark.export_frame_count if test_count is None else test_count
+        outputs = ["predictions"]
+
+        with tf.Graph().as_default():
+            model = Model(True)
+            with tf.Session() as session:
+                model.init(session)
+                model.load_from_save(session)
+                paths = {"float": model.export_frozen(session, name, outputs),
+                         "int8": model.export_quantized(session, name,
+                                                        Benchmark.generated_frames(calibration_count, self.seed)[0],
+                                                        outputs)}
+
+        frames, labels = Benchmark.generated_frames(test_count, self.seed + 1)
+        results = {"commit": Benchmark.commit(), "calibration_frames": calibration_count, "test_frames": test_count}
+        predictions = {}
+        for precision, path in paths.items():
+            with tf.Graph().as_default() as graph:
+                graph_def = tf.GraphDef()
+                with tf.gfile.GFile(path, "rb") as file:
+                    graph_def.ParseFromString(file.read())
+                tf.import_graph_def(graph_def, name="")
+                with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as session:
+                    (predictions[precision],), latency = Benchmark.frame_latency(session, graph, outputs, frames)
+            results[precision] = {"path": path, "bytes": Benchmark.size_of(path), "latency": latency}
+
+        pitches = Model.end_pitch - Model.start_pitch
+        float_predictions = predictions["float"].reshape(1, -1, pitches)
+        int8_predictions = predictions["int8"].reshape(1, -1, pitches)
+        for precision, precision_predictions in (("float", float_predictions), ("int8", int8_predictions)):
+            scores = Evaluator.scores(precision_predictions[:, 4:], labels[np.newaxis, :-4])
+            # the prediction of each frame is for the frame 4 before it, the middle of the frames that the model sees
+            results[precision]["accuracy"] = {key: float(value) for key, value in scores.items()}
+
+        results["agreement"] = Evaluator.scores(int8_predictions, float_predictions > Transcriber.threshold)
+        results["agreement"]["max_prediction_difference"] = np.max(np.abs(int8_predictions - float_predictions))
+        results["agreement"]["mean_prediction_difference"] = np.mean(np.abs(int8_predictions - float_predictions))
+        results["agreement"] = {key: float(value) for key, value in results["agreement"].items()}
+        results["speed_up"] = results["float"]["latency"]["frame"]["mean"] / results["int8"]["latency"]["frame"]["mean"]
+        results["size_ratio"] = results["int8"]["bytes"] / results["float"]["bytes"]
+
+        print(json.dumps(results, indent=2))
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+        return results
+
+    @staticmethod
+    def generated_frames(count, random_seed):
+        """
+        Frames of samples from generated examples, in the order that the Kotlin application would read them, which
+        are the examples of a batch one after the other, along with the labels of each frame
+        """
+        seed(random_seed)
+        np.random.seed(random_seed)
+        data_generator = DataGenerator()
+
+        frames = []
+        frame_labels = []
+        while len(frames) < count:
+            _, labels = data_generator.generate_batch
+            signals = data_generator.workspace.signals
+            for signal, example_labels in zip(signals, labels):
+                starts = range(0, signal.size - Model.frame_length + 1, Model.frame_step)[:len(example_labels)]
+                starts = starts[:count - len(frames)]
+                frames += [signal[start:start + Model.frame_length].copy() for start in starts]
+                frame_labels += list(example_labels[:len(starts)])
+
+        return np.array(frames), np.array(frame_labels)
+
+    @staticmethod
+    def export_frames():
+        """The frames of samples that the export models are measured with"""
+        return np.random.RandomState(0).normal(0, 1000, (Benchmark.export_frame_count, Model.frame_length)).astype(
+            np.float32)
+
+    @staticmethod
+    def frame_latency(session, graph, outputs, frames):
+        """
+        Runs the frames through an export graph one at a time, the same way as the Kotlin application does. Returns
+        the outputs of every frame and the latency of each frame.
+        """
+        inputs = graph.get_tensor_by_name("inputs:0")
+        fetches = [graph.get_tensor_by_name(name + ":0") for name in outputs]
+        fetches.append(graph.get_operation_by_name("enqueue_new_inputs"))
+
+        session.run(graph.get_operation_by_name("enqueue_start_inputs"), {inputs: frames[0]})
+
+        results = []
+        frame_times = []
+        for frame in frames:
+            start_time = time.perf_counter()
+            results.append(session.run(fetches, {inputs: frame})[:-1])
+            frame_times.append(time.perf_counter() - start_time)
+
+        frame_times = frame_times[1:]  # the first frame includes one off costs
+        latency = {"frame": {"mean": float(np.mean(frame_times)), "min": float(np.min(frame_times)),
+                             "max": float(np.max(frame_times)), "p95": float(np.percentile(frame_times, 95))},
+                   "frames_per_second": 1 / float(np.mean(frame_times))}
+
+        return [np.array([result[index] for result in results]) for index in range(len(outputs))], latency
+
+    @staticmethod
+    def size_of(path):
+        """The size of a file or a folder in bytes"""
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(folder, file_name))
+                   for folder, _, file_names in os.walk(path) for file_name in file_names)
+
+
+def run_training(data_source, continue_training, log_file="log.csv", workers=None, prefetch=None,
+                 validation_set=None):
+    """
+    Trains a new model on the batches of the data source. Without a data source the batches are generated by a
+    GeneratorPool with this many workers and prefetched batches, which is stopped when the training ends.
+    """
+    if validation_set is None and Trainer.validation_folder is not None:
+        validation_set = Evaluator.validation_set(Trainer.validation_folder)
+        # generating the validation set starts processes of its own, so it's done before the generator processes and
+        # the session are started, and the training doesn't have to wait for it once it has started
+
+    if data_source is None:
+        data_source = GeneratorPool(workers, prefetch)
+        try:
+            run_training(data_source, continue_training, log_file, validation_set=validation_set)
+        finally:
+            data_source.stop()
+        return
+
+    if continue_training:
+        statistics = Model.load_statistics()
+    elif data_source.statistics is not None:
+        statistics = data_source.statistics
+    elif isinstance(data_source, GeneratorPool):
+        statistics = data_source.collect_statistics()
+    else:
+        statistics = FeatureStatistics.collect(data_source)
+    # a continued model has to keep the statistics that it was trained with, which are saved with each save
+
+    model = Model(False, data_source, statistics=statistics)
+    trainer = Trainer(data_source, model, validation_set)
+
+    with tf.Session() as session:
+        model.init(session)
+        trainer.train(session, continue_training, log_file)
 
 
 def main():
     """The entry point"""
 
-    selected = input("Train/Export the model ? (ENTER for train otherwise save name)")
+    parser = argparse.ArgumentParser(description="Trains and exports the model, with no command the questions about "
+                                                 "what to do are asked interactively")
+    parser.add_argument("--profile", help="profile the stages of generating batches, 1 to print a summary of them "
+                                           "or the path of a trace file to write")
+    commands = parser.add_subparsers(dest="command")
+
+    train_parser = commands.add_parser("train", help="trains the model")
+    train_parser.add_argument("--continue", dest="continue_training", action="store_true",
+                              help="continue training the last saved model")
+    train_parser.add_argument("--shards", help="train from a precomputed dataset instead of generating batches")
+    train_parser.add_argument("--augment", action="store_true",
+                              help="augment the precomputed batches of --shards so that they are different every time")
+    train_parser.add_argument("--log", default="log.csv", help="the file that the costs are logged to")
+    train_parser.add_argument("--workers", type=int, default=GeneratorPool.workers,
+                              help="the processes that generate the batches")
+    train_parser.add_argument("--prefetch", type=int, default=GeneratorPool.prefetch,
+                              help="the most batches that the generator processes can have waiting")
+    train_parser.add_argument("--print-interval", type=int, default=TrainingMetrics.print_interval,
+                              help="the amount of training steps between each printed progress line")
+    train_parser.add_argument("--save-interval", type=float, default=CheckpointManager.save_interval,
+                              help="the seconds between each save, 0 to only save by steps")
+    train_parser.add_argument("--save-steps", type=int, default=CheckpointManager.save_steps,
+                              help="the training steps between each save, 0 to only save by time")
+    train_parser.add_argument("--keep-saves", type=int, default=CheckpointManager.keep_last,
+                              help="the amount of the most recent saves that are kept")
+    train_parser.add_argument("--half-features", action="store_true",
+                              help="send the generated features as float16 to halve the size of the batches")
+    train_parser.add_argument("--warmup-batches", type=int, default=FeatureStatistics.warmup_batches,
+                              help="the batches that the feature statistics are collected from for a new model")
+    train_parser.add_argument("--validation", help="where the validation set is cached, which the saves are "
+                                                   "evaluated on in the background while training")
+    train_parser.add_argument("--validation-interval", type=float, default=Evaluator.interval,
+                              help="the seconds between each check for a new save to evaluate")
+    train_parser.add_argument("--curriculum", type=Trainer.parse_curriculum,
+                              help="the example lengths to train on from each epoch, as epoch:seconds pairs")
+    train_parser.add_argument("--batch-size", type=int, default=Trainer.batch_size,
+                              help="the examples of each update, which are split evenly between the accumulated "
+                                   "batches and then between the towers")
+    train_parser.add_argument("--towers", type=int, default=Trainer.towers,
+                              help="the amount of copies of the model that each batch is split between")
+    train_parser.add_argument("--accumulate", type=int, default=Trainer.accumulation_steps,
+                              help="the amount of batches that each update is split into, whose gradients are added up")
+
+    precompute_parser = commands.add_parser("precompute", help="generates a dataset of batches and saves it to disk")
+    precompute_parser.add_argument("directory", help="where the dataset is saved")
+    precompute_parser.add_argument("--batches", type=int, required=True)
+    precompute_parser.add_argument("--seed", type=int, default=0)
+    precompute_parser.add_argument("--shard-size", type=int, default=ShardedDataset.shard_size,
+                                   help="the amount of batches in each shard")
+    precompute_parser.add_argument("--workers", type=int, default=GeneratorPool.workers)
+    precompute_parser.add_argument("--batch-size", type=int, default=Trainer.batch_size,
+                                   help="the examples of each batch, which has to be the same as the batches of the "
+                                        "training after they are split between the accumulated batches")
+    precompute_parser.add_argument("--half-features", action="store_true",
+                                   help="store the features as float16 to halve the size of the dataset")
+
+    commands.add_parser("refresh-chords", help="downloads the guitar chords and rebuilds the chord library")
+    commands.add_parser("build-sound-bank", help="converts the sounds into memory mapped sound banks")
+
+    transcribe_parser = commands.add_parser("transcribe", help="transcribes wav files with the last saved model")
+    transcribe_parser.add_argument("inputs", nargs="+", help="wav files or folders of them")
+    transcribe_parser.add_argument("--out", default=".", help="the folder that the transcriptions are saved to")
+
+    export_parser = commands.add_parser("export", help="exports the last saved model")
+    export_parser.add_argument("name", help="the name that is added to the end of the export path")
+    export_parser.add_argument("--frozen", action="store_true",
+                               help="export a frozen graph with only the outputs that are asked for")
+    export_parser.add_argument("--outputs", nargs="+", default=Model.frozen_outputs,
+                               help="the outputs that the frozen graph keeps")
+    export_parser.add_argument("--int8", action="store_true",
+                               help="export a frozen graph with eight bit layers, calibrated on generated audio")
+    export_parser.add_argument("--calibration-frames", type=int, default=Benchmark.calibration_frame_count)
+
+    compare_parser = commands.add_parser("compare-export", help="compares the size and latency of the SavedModel "
+                                                                "export with the frozen one")
+    compare_parser.add_argument("name", help="the name that is added to the end of the export path")
+    compare_parser.add_argument("--outputs", nargs="+", default=Model.frozen_outputs,
+                                help="the outputs that the frozen graph keeps")
+    compare_parser.add_argument("--out", default="export_comparison.json", help="where the results are saved")
+
+    quantized_parser = commands.add_parser("compare-quantized", help="compares the accuracy and latency of the eight "
+                                                                     "bit export with the float one")
+    quantized_parser.add_argument("name", help="the name that is added to the end of the export path")
+    quantized_parser.add_argument("--out", default="quantized_comparison.json", help="where the results are saved")
+    quantized_parser.add_argument("--seed", type=int, default=0)
+    quantized_parser.add_argument("--calibration-frames", type=int, default=Benchmark.calibration_frame_count)
+    quantized_parser.add_argument("--test-frames", type=int, default=Benchmark.export_frame_count)
+
+    benchmark_parser = commands.add_parser("benchmark", help="measures the speed of the generator and the model")
+    benchmark_parser.add_argument("--out", default="benchmark.json", help="where the results are saved")
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    benchmark_parser.add_argument("--repeats", type=int, default=Benchmark.repeats)
+    benchmark_parser.add_argument("--batch-sizes", type=int, nargs="+", default=Benchmark.batch_sizes,
+                                  help="the batch sizes that the training steps are measured at")
+
+    arguments = parser.parse_args()
+
+    if arguments.profile is not None:
+        os.environ[StageProfiler.environment_variable] = arguments.profile
+        # the environment is inherited by the generator processes
+
+    if arguments.command == "train":
+
+        if arguments.augment and arguments.shards is None:
+            train_parser.error("--augment only works with --shards, the generated batches are all new anyway")
+        if arguments.workers < 1 or arguments.prefetch < 1:
+            train_parser.error("--workers and --prefetch have to be at least 1")
+        if arguments.save_interval < 0 or (arguments.save_steps is not None and arguments.save_steps < 0):
+            train_parser.error("--save-interval and --save-steps can't be negative")
+        if arguments.towers < 1 or arguments.accumulate < 1:
+            train_parser.error("--towers and --accumulate have to be at least 1")
+        if arguments.batch_size < 1 or arguments.batch_size % (arguments.towers * arguments.accumulate) != 0:
+            train_parser.error("--batch-size has to be split evenly between {} accumulated batches and {} towers, "
+                               "so it has to be a multiple of {}".format(arguments.accumulate, arguments.towers,
+                                                                         arguments.towers * arguments.accumulate))
+
+        TrainingMetrics.print_interval = arguments.print_interval
+        CheckpointManager.save_interval = arguments.save_interval
+        CheckpointManager.save_steps = arguments.save_steps
+        CheckpointManager.keep_last = arguments.keep_saves
+        Trainer.towers = arguments.towers
+        Trainer.accumulation_steps = arguments.accumulate
+        Trainer.batch_size = arguments.batch_size // arguments.accumulate
+        # this is the size of the batches that are read, and it's what the towers split between themselves
+        FeatureStatistics.warmup_batches = arguments.warmup_batches
+        Trainer.curriculum = arguments.curriculum
+        Trainer.validation_folder = arguments.validation
+        Evaluator.interval = arguments.validation_interval
+        if arguments.half_features:
+            DataGenerator.feature_dtype = np.float16
+
+        if arguments.shards is not None:
+            augmenter = FeatureAugmenter() if arguments.augment else None
+            run_training(ShardedDataset(arguments.shards, augmenter=augmenter), arguments.continue_training,
+                         arguments.log)
+        else:
+            run_training(None, arguments.continue_training, arguments.log, arguments.workers, arguments.prefetch)
 
-    if len(selected) == 0:  # train
+    elif arguments.command == "precompute":
 
-        continue_training = len(
-            input("Do you want to continue training the last saved model? (ENTER for no/any for yes)")) != 0
-        # I would have called this continue but it's a keyword
+        if arguments.batch_size < 1:
+            precompute_parser.error("--batch-size has to be at least 1")
+        Trainer.batch_size = arguments.batch_size
+        if arguments.half_features:
+            DataGenerator.feature_dtype = np.float16
+        ShardedDataset.precompute(arguments.directory, arguments.batches, arguments.seed, arguments.shard_size,
+                                  arguments.workers)
 
-        data_generator = DataGenerator()
-        model = Model(False)
-        trainer = Trainer(data_generator, model)
+    elif arguments.command == "refresh-chords":
 
-        with tf.Session() as session:
-            model.init(session)
-            trainer.train(session, continue_training, "log.csv")
+        DataGenerator.refresh_chords()
+
+    elif arguments.command == "transcribe":
+
+        file_paths = []
+        for path in arguments.inputs:
+            if os.path.isdir(path):
+                file_paths += sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                     if file_name.endswith(".wav"))
+            else:
+                file_paths.append(path)
 
-    else:  # save
+        os.makedirs(arguments.out, exist_ok=True)
+        transcriber = Transcriber()
+        for file_path in file_paths:
+            transcriber.transcribe(file_path, arguments.out)
+
+    elif arguments.command == "export":
 
         model = Model(True)
         with tf.Session() as session:
             model.init(session)
             model.load_from_save(session)
-            model.export(session, selected)
+            if arguments.int8:
+                model.export_quantized(session, arguments.name,
+                                       Benchmark.generated_frames(arguments.calibration_frames, 0)[0],
+                                       arguments.outputs)
+            elif arguments.frozen:
+                model.export_frozen(session, arguments.name, arguments.outputs)
+            else:
+                model.export(session, arguments.name)
+
+    elif arguments.command == "compare-export":
+
+        Benchmark().compare_exports(arguments.name, arguments.out, arguments.outputs)
+
+    elif arguments.command == "compare-quantized":
+
+        Benchmark(arguments.seed).compare_quantized(arguments.name, arguments.out, arguments.calibration_frames,
+                                                    arguments.test_frames)
+
+    elif arguments.command == "benchmark":
+
+        Benchmark(arguments.seed, arguments.repeats, arguments.batch_sizes).run(arguments.out)
+
+    elif arguments.command == "build-sound-bank":
+
+        for folder in [DataGenerator.guitars_folder, DataGenerator.noise_folder, DataGenerator.instruments_folder]:
+            if os.path.isdir(folder):
+                DataGenerator.build_sound_bank(folder)
+
+    else:
+        selected = input("Train/Export the model ? (ENTER for train otherwise save name)")
+
+        if len(selected) == 0:  # train
+
+            continue_training = len(
+                input("Do you want to continue training the last saved model? (ENTER for no/any for yes)")) != 0
+            # I would have called this continue but it's a keyword
+
+            run_training(None, continue_training)
+
+        else:  # save
+
+            model = Model(True)
+            with tf.Session() as session:
+                model.init(session)
+                model.load_from_save(session)
+                model.export(session, selected)
 
 
 if __name__ == '__main__':